@@ -5,77 +5,514 @@ among the 5 primary WebP files per era.
 Flags:
   - DARK:   mean brightness < 60  (likely black watermark background)
   - TINY:   file size < 5KB       (placeholder / failed download)
-  - DUP:    identical file size as another era's same-numbered image
+  - DUP:    perceptual near-duplicate of an earlier image (dHash
+            Hamming distance <= 6), e.g. a re-encoded copy in another era
   - FLAT:   pixel std-dev < 15    (very low-detail / solid colour)
+
+Near-duplicates are found through a BK-tree over 64-bit difference hashes,
+so each lookup only visits hashes within reach of the query instead of
+comparing every pair.
+
+Each image is decoded at reduced scale (JPEG draft mode, otherwise a box
+reduce to ~AUDIT_SIZE px) and every metric — mean brightness, std-dev,
+luma entropy, edge density and colourfulness — is computed in one NumPy
+pass. Files are audited on a process pool.
+
+Results are cached in audit_cache.sqlite3 keyed by (path, size, mtime,
+SHA-256), so a re-audit only decodes new or changed files. The cache is
+dropped automatically whenever METRICS_VERSION, the decode size or any
+threshold changes.
+
+With --all, every crawled candidate in every era folder (any extension in
+image_common.IMAGE_EXTENSIONS, not just 000001–000005.webp) is streamed
+through a bounded worker pipeline and written incrementally as JSON Lines;
+near-duplicates are matched against everything seen so far in the stream.
+
+Usage:
+    python audit_images.py               # one worker per CPU
+    python audit_images.py --workers 1   # serial, in-process
+    python audit_images.py --no-cache    # re-audit everything
+    python audit_images.py --all --out audit_results.jsonl
 """
+import argparse
+import json
 import os
-from pathlib import Path
-from PIL import Image, ImageStat
+import sqlite3
 from collections import defaultdict
+from collections.abc import Iterator
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from functools import partial
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+from convert_webp import file_sha256
+from image_common import AUDIT_SIZE, IMAGE_EXTENSIONS, load_reduced
 
 ASSETS = Path(__file__).parent / "assets"
 WEBP_NAMES = [f"{n:06d}.webp" for n in range(1, 6)]
 
-results = []
-size_map = defaultdict(list)  # size_bytes -> list of (era, filename)
+DARK_BRIGHTNESS = 60     # mean brightness below this → DARK
+TINY_BYTES = 5_000       # file size below this → TINY
+FLAT_STDDEV = 15         # mean per-channel std-dev below this → FLAT
+
+EDGE_THRESHOLD = 32      # luma gradient magnitude counted as an edge
+DUP_DISTANCE = 6         # max dHash Hamming distance for a near-duplicate
+WORKERS = os.cpu_count() or 1
+
+STREAM_OUT = Path(__file__).parent / "audit_results.jsonl"
+INFLIGHT_PER_WORKER = 4  # --all: max queued files per worker (bounds memory)
+
+CACHE_FILE = Path(__file__).parent / "audit_cache.sqlite3"
+METRICS_VERSION = 1      # bump when compute_metrics() / dhash() change meaning
+
+
+def compute_metrics(rgb: np.ndarray) -> dict[str, float]:
+    """All audit metrics for one H×W×3 float image."""
+    pixels = rgb.reshape(-1, 3)
+    r, g, b = pixels[:, 0], pixels[:, 1], pixels[:, 2]
+
+    # Brightness / std-dev match ImageStat: per-channel, then averaged
+    brightness = float(pixels.mean())
+    std_dev = float(pixels.std(axis=0).mean())
+
+    # Shannon entropy of the ITU-R 601 luma histogram, in bits
+    luma = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    hist = np.bincount(luma.astype(np.uint8).ravel(), minlength=256)
+    p = hist[hist > 0] / luma.size
+    entropy = float(-(p * np.log2(p)).sum())
+
+    # Fraction of pixels whose luma gradient magnitude exceeds EDGE_THRESHOLD
+    gx = np.abs(np.diff(luma, axis=1))[:-1, :]
+    gy = np.abs(np.diff(luma, axis=0))[:, :-1]
+    edges = float((np.hypot(gx, gy) > EDGE_THRESHOLD).mean()) if gx.size else 0.0
+
+    # Hasler & Süsstrunk colourfulness
+    rg = r - g
+    yb = 0.5 * (r + g) - b
+    colourfulness = float(
+        np.hypot(rg.std(), yb.std()) + 0.3 * np.hypot(rg.mean(), yb.mean())
+    )
+
+    return {
+        "brightness": round(brightness, 1),
+        "std": round(std_dev, 1),
+        "entropy": round(entropy, 2),
+        "edges": round(edges, 3),
+        "colour": round(colourfulness, 1),
+    }
+
+
+def dhash(rgb: np.ndarray) -> int:
+    """64-bit difference hash: sign of horizontal luma steps on a 9×8 grid."""
+    luma = rgb @ np.array([0.299, 0.587, 0.114], dtype=np.float32)
+    small = Image.fromarray(luma.astype(np.uint8)).resize((9, 8), Image.LANCZOS)
+    px = np.asarray(small, dtype=np.int16)
+    bits = (px[:, 1:] > px[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """Burkhard–Keller tree over integer hashes in Hamming space.
+
+    search() prunes every subtree whose edge distance lies outside
+    [d - radius, d + radius], so near-duplicate lookups are sub-linear.
+    """
+
+    def __init__(self) -> None:
+        self.root = None   # [hash, items, {distance: child}]
+
+    def add(self, h: int, item) -> None:
+        if self.root is None:
+            self.root = [h, [item], {}]
+            return
+        node = self.root
+        while True:
+            d = hamming(h, node[0])
+            if d == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, [item], {}]
+                return
+            node = child
+
+    def search(self, h: int, radius: int) -> list[tuple[int, object]]:
+        """All (distance, item) pairs within *radius* of *h*."""
+        found = []
+        stack = [self.root] if self.root is not None else []
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d <= radius:
+                found.extend((d, item) for item in node[1])
+            for edge, child in node[2].items():
+                if d - radius <= edge <= d + radius:
+                    stack.append(child)
+        return found
+
+
+def duplicate_clusters(results: list[dict], radius: int = DUP_DISTANCE) -> list[list[tuple[int, dict]]]:
+    """Group results whose dHashes lie within *radius* of each other.
+
+    Returns clusters of (distance_to_first_member, result), first member
+    first; clusters are formed transitively (single linkage).
+    """
+    hashed = [r for r in results if r.get("dhash")]
+    tree = BKTree()
+    for i, r in enumerate(hashed):
+        tree.add(int(r["dhash"], 16), i)
+
+    parent = list(range(len(hashed)))
+
+    def find(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for i, r in enumerate(hashed):
+        for _, j in tree.search(int(r["dhash"], 16), radius):
+            parent[find(j)] = find(i)
+
+    groups: dict[int, list[int]] = defaultdict(list)
+    for i in range(len(hashed)):
+        groups[find(i)].append(i)
+
+    clusters = []
+    for members in groups.values():
+        if len(members) < 2:
+            continue
+        members.sort()
+        head = int(hashed[members[0]]["dhash"], 16)
+        clusters.append([(hamming(head, int(hashed[i]["dhash"], 16)), hashed[i]) for i in members])
+    return clusters
+
+
+def flag_image(size_bytes: int, metrics: dict[str, float]) -> list[str]:
+    flags = []
+    if metrics["brightness"] < DARK_BRIGHTNESS:
+        flags.append("DARK")
+    if size_bytes < TINY_BYTES:
+        flags.append("TINY")
+    if metrics["std"] < FLAT_STDDEV:
+        flags.append("FLAT")
+    return flags
+
 
-for era_dir in sorted(ASSETS.iterdir()):
-    if not era_dir.is_dir() or era_dir.name == "thumbs":
-        continue
-    for fname in WEBP_NAMES:
-        fpath = era_dir / fname
-        if not fpath.exists():
-            results.append((era_dir.name, fname, ["MISSING"], 0, 0, 0))
+def audit_file(fpath: Path) -> dict:
+    """Audit one image. Runs inside a worker process."""
+    result = {"era": fpath.parent.name, "file": fpath.name}
+    if not fpath.exists():
+        return {**result, "flags": ["MISSING"], "size": 0, "dhash": None,
+                "brightness": 0, "std": 0, "entropy": 0, "edges": 0, "colour": 0}
+    return audit_result(fpath.parent.name, fpath.name, fpath.stat().st_size, load_reduced(fpath))
+
+
+def audit_result(era: str, name: str, size_bytes: int, rgb: np.ndarray) -> dict:
+    """The audit record for one already-decoded image (see load_reduced)."""
+    metrics = compute_metrics(rgb)
+    return {
+        "era": era,
+        "file": name,
+        "flags": flag_image(size_bytes, metrics),
+        "size": size_bytes,
+        "dhash": f"{dhash(rgb):016x}",
+        **metrics,
+    }
+
+
+def _audit_task(fpath: Path, hashed: bool = True) -> tuple[dict, str | None]:
+    """Audit *fpath*; also hash it for the cache unless *hashed* is False."""
+    return audit_file(fpath), file_sha256(fpath) if hashed else None
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Result cache
+# ─────────────────────────────────────────────────────────────────────────────
+
+def cache_fingerprint() -> str:
+    """Everything a cached result depends on besides the file itself."""
+    return json.dumps([
+        METRICS_VERSION, AUDIT_SIZE, EDGE_THRESHOLD,
+        DARK_BRIGHTNESS, TINY_BYTES, FLAT_STDDEV,
+    ])
+
+
+class AuditCache:
+    """Per-image audit results in SQLite, keyed by path relative to assets/.
+
+    A row is reused when size and mtime match; if only the mtime moved, the
+    stored SHA-256 is compared before the row is trusted.
+    """
+
+    def __init__(self, path: Path = CACHE_FILE) -> None:
+        self.db = sqlite3.connect(path)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+            CREATE TABLE IF NOT EXISTS results (
+                path     TEXT PRIMARY KEY,
+                size     INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                sha256   TEXT NOT NULL,
+                result   TEXT NOT NULL
+            );
+        """)
+        row = self.db.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+        if row is None or row[0] != cache_fingerprint():
+            with self.db:
+                self.db.execute("DELETE FROM results")
+                self.db.execute(
+                    "INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)",
+                    (cache_fingerprint(),),
+                )
+
+    def get(self, fpath: Path) -> dict | None:
+        row = self.db.execute(
+            "SELECT size, mtime_ns, sha256, result FROM results WHERE path = ?",
+            (str(fpath.relative_to(ASSETS)),),
+        ).fetchone()
+        if row is None:
+            return None
+        size, mtime_ns, sha256, result = row
+        st = fpath.stat()
+        if size != st.st_size:
+            return None
+        if mtime_ns != st.st_mtime_ns:
+            if sha256 != file_sha256(fpath):
+                return None
+            self.put(fpath, sha256, json.loads(result))
+        return json.loads(result)
+
+    def put(self, fpath: Path, sha256: str, result: dict) -> None:
+        st = fpath.stat()
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)",
+                (str(fpath.relative_to(ASSETS)), st.st_size, st.st_mtime_ns,
+                 sha256, json.dumps(result)),
+            )
+
+    def close(self) -> None:
+        self.db.close()
+
+
+def audit_paths() -> list[Path]:
+    return [
+        era_dir / fname
+        for era_dir in sorted(ASSETS.iterdir())
+        if era_dir.is_dir() and era_dir.name != "thumbs"
+        for fname in WEBP_NAMES
+    ]
+
+
+def report(results: list[dict]) -> None:
+    # Every member of a near-duplicate cluster after the first is a DUP
+    clusters = duplicate_clusters(results)
+    for cluster in clusters:
+        for _, r in cluster[1:]:
+            r["flags"].append("DUP")
+
+    print("=" * 70)
+    print("IMAGE AUDIT REPORT")
+    print("=" * 70)
+
+    issues = [r for r in results if r["flags"]]
+    clean  = [r for r in results if not r["flags"]]
+
+    print(f"\nTotal images checked : {len(results)}")
+    print(f"Issues flagged       : {len(issues)}")
+    print(f"Clean                : {len(clean)}")
+
+    if issues:
+        print("\n--- FLAGGED IMAGES ---")
+        for r in issues:
+            flag_str = " | ".join(r["flags"])
+            print(f"  [{flag_str}]  {r['era']}/{r['file']}")
+            print(f"           size={r['size']//1024}KB  brightness={r['brightness']}/255  std={r['std']}")
+
+    if clusters:
+        print(f"\n--- NEAR-DUPLICATES (dHash Hamming distance <= {DUP_DISTANCE}) ---")
+        for cluster in clusters:
+            print(f"  cluster of {len(cluster)}:")
+            for dist, r in cluster:
+                print(f"    d={dist:<2}  {r['era']}/{r['file']}  {r['size']//1024}KB")
+
+    print("\n--- ALL RESULTS ---")
+    for r in results:
+        flag_str = (" [" + " ".join(r["flags"]) + "]") if r["flags"] else ""
+        print(
+            f"  {r['era']}/{r['file']}  {r['size']//1024}KB  br={r['brightness']}  std={r['std']}"
+            f"  ent={r['entropy']}  edge={r['edges']}  col={r['colour']}{flag_str}"
+        )
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Streaming audit (--all)
+# ─────────────────────────────────────────────────────────────────────────────
+
+def iter_candidates() -> Iterator[Path]:
+    """Every image file directly inside every era folder, lazily.
+
+    Subfolders (thumbs/, srcset ladders) hold derived renditions and are
+    not candidates.
+    """
+    for era_dir in sorted(ASSETS.iterdir()):
+        if not era_dir.is_dir():
             continue
+        for p in sorted(era_dir.iterdir()):
+            if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS:
+                yield p
+
+
+def stream_audit(
+    paths: Iterator[Path], out_path: Path, workers: int, cache: "AuditCache | None",
+) -> None:
+    """Audit *paths* with at most workers × INFLIGHT_PER_WORKER files in
+    flight, appending one JSON object per file to *out_path* as each
+    finishes. Only the dHash index is held in memory.
+    """
+    tree = BKTree()
+    counts = {"files": 0, "cached": 0, "flagged": 0, "dups": 0, "errors": 0}
+
+    def emit(p: Path, result: dict | None, error: str | None = None) -> None:
+        counts["files"] += 1
+        rel = str(p.relative_to(ASSETS))
+        if result is None:
+            counts["errors"] += 1
+            record = {"path": rel, "error": error}
+        else:
+            record = {"path": rel, **result}
+            if result.get("dhash"):
+                h = int(result["dhash"], 16)
+                near = tree.search(h, DUP_DISTANCE)
+                if near:
+                    dist, other = min(near, key=lambda m: m[0])
+                    record["flags"] = record["flags"] + ["DUP"]
+                    record["dup_of"], record["dup_distance"] = other, dist
+                    counts["dups"] += 1
+                tree.add(h, rel)
+            counts["flagged"] += bool(record["flags"])
+        out.write(json.dumps(record) + "\n")
+        out.flush()
+
+    def collect(p: Path, fn) -> None:
+        try:
+            result, sha256 = fn()
+        except Exception as e:  # noqa: BLE001 — corrupt/unsupported crawl output
+            emit(p, None, str(e))
+            return
+        if cache is not None:
+            cache.put(p, sha256, result)
+        emit(p, result)
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    inflight: dict = {}
+    with out_path.open("w", encoding="utf-8") as out:
+        try:
+            for p in paths:
+                if cache is not None and (hit := cache.get(p)) is not None:
+                    counts["cached"] += 1
+                    emit(p, hit)
+                elif pool is None:
+                    collect(p, lambda p=p: _audit_task(p, cache is not None))
+                else:
+                    inflight[pool.submit(_audit_task, p, cache is not None)] = p
+                    if len(inflight) >= workers * INFLIGHT_PER_WORKER:
+                        done, _ = wait(inflight, return_when=FIRST_COMPLETED)
+                        for f in done:
+                            collect(inflight.pop(f), f.result)
+            for f in list(inflight):
+                collect(inflight.pop(f), f.result)
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+    print(
+        f"Audited {counts['files']} file(s) ({counts['cached']} from cache) → {out_path}\n"
+        f"Flagged: {counts['flagged']}  Near-duplicates: {counts['dups']}  "
+        f"Unreadable: {counts['errors']}"
+    )
+
+
+def main(
+    workers: int = WORKERS,
+    use_cache: bool = True,
+    all_candidates: bool = False,
+    out_path: Path = STREAM_OUT,
+) -> None:
+    cache = AuditCache() if use_cache else None
+    if all_candidates:
+        try:
+            stream_audit(iter_candidates(), out_path, workers, cache)
+        finally:
+            if cache is not None:
+                cache.close()
+        return
+
+    paths = audit_paths()
+
+    results: dict[Path, dict] = {}
+    todo: list[Path] = []
+    for p in paths:
+        if not p.exists():
+            results[p] = audit_file(p)
+        elif cache is not None and (hit := cache.get(p)) is not None:
+            results[p] = hit
+        else:
+            todo.append(p)
+
+    # Without the cache nothing reads the hash, so skip that extra full read
+    task = partial(_audit_task, hashed=cache is not None)
+    if workers > 1 and len(todo) > 1:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        audited = pool.map(task, todo, chunksize=4)
+    else:
+        pool = None
+        audited = map(task, todo)
+    try:
+        for p, (result, sha256) in zip(todo, audited):
+            if cache is not None:
+                cache.put(p, sha256, result)
+            results[p] = result
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if cache is not None:
+            cache.close()
+
+    print(f"Audited {len(todo)} file(s); {len(paths) - len(todo)} from cache.\n")
+    report([results[p] for p in paths])
+
 
-        size_bytes = fpath.stat().st_size
-        size_map[size_bytes].append((era_dir.name, fname))
-
-        with Image.open(fpath) as img:
-            img_rgb = img.convert("RGB")
-            stat = ImageStat.Stat(img_rgb)
-            mean_brightness = sum(stat.mean) / 3
-            std_dev = sum(stat.stddev) / 3
-
-        flags = []
-        if mean_brightness < 60:
-            flags.append("DARK")
-        if size_bytes < 5_000:
-            flags.append("TINY")
-        if std_dev < 15:
-            flags.append("FLAT")
-
-        results.append((era_dir.name, fname, flags, size_bytes, round(mean_brightness, 1), round(std_dev, 1)))
-
-# Find duplicates (same file size across eras)
-dup_sizes = {sz: paths for sz, paths in size_map.items() if len(paths) > 1}
-
-print("=" * 70)
-print("IMAGE AUDIT REPORT")
-print("=" * 70)
-
-issues = [r for r in results if r[2]]
-clean  = [r for r in results if not r[2]]
-
-print(f"\nTotal images checked : {len(results)}")
-print(f"Issues flagged       : {len(issues)}")
-print(f"Clean                : {len(clean)}")
-
-if issues:
-    print("\n--- FLAGGED IMAGES ---")
-    for era, fname, flags, size, brightness, std in issues:
-        flag_str = " | ".join(flags)
-        print(f"  [{flag_str}]  {era}/{fname}")
-        print(f"           size={size//1024}KB  brightness={brightness}/255  std={std}")
-
-if dup_sizes:
-    print("\n--- POTENTIAL DUPLICATES (identical file size) ---")
-    for sz, paths in sorted(dup_sizes.items()):
-        print(f"  {sz//1024}KB:")
-        for era, fname in paths:
-            print(f"    {era}/{fname}")
-
-print("\n--- ALL RESULTS ---")
-for era, fname, flags, size, brightness, std in results:
-    flag_str = (" [" + " ".join(flags) + "]") if flags else ""
-    print(f"  {era}/{fname}  {size//1024}KB  br={brightness}  std={std}{flag_str}")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--workers", type=int, default=WORKERS,
+        help=f"worker processes (default: CPU count, {WORKERS}); 1 = serial",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help=f"ignore and do not update {CACHE_FILE.name}",
+    )
+    parser.add_argument(
+        "--all", action="store_true",
+        help="stream every crawled candidate, not just 000001–000005.webp",
+    )
+    parser.add_argument(
+        "--out", type=Path, default=STREAM_OUT,
+        help=f"JSON Lines output for --all (default: {STREAM_OUT.name})",
+    )
+    args = parser.parse_args()
+    main(
+        workers=max(1, args.workers),
+        use_cache=not args.no_cache,
+        all_candidates=args.all,
+        out_path=args.out,
+    )
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Benchmark fashion_crawler.py offline, against a local mock of Bing and Baidu.
+
+MockEngineServer is a threaded HTTP server on 127.0.0.1 that answers the
+three kinds of request the crawler makes:
+
+  /images/async?q=…&first=N      Bing-shaped HTML: div.imgpt > a[m] JSON
+                                 carrying a "murl" image URL per result
+  /search/acjson?word=…&pn=N     Baidu-shaped JSON: {"data": [{"hoverURL"}]}
+  /img/<token>.jpg               a JPEG generated from the token (cached)
+
+Every engine session in fashion_crawler.SESSIONS gets a MockAdapter that
+rewrites each request to the mock server, keeping the path and query, so
+the real code path — run_engine → crawl_bing/crawl_baidu → icrawler's
+feeder and parser → the download stage → BlobStorage — runs unchanged.
+Result pages spread their image URLs over IMAGE_HOSTS fake hostnames, so
+the per-host download limits behave as they do against real CDNs.
+
+Each request gets a simulated latency and may instead fail: a timeout
+(the server hangs past the client timeout), a 403 or a 429. Outcomes are
+drawn from a generator seeded by --seed, the request URL and how many
+times that URL has been requested, so a run is repeatable regardless of
+thread interleaving. A share of image URLs point at a small shared pool
+(duplicate bytes across queries) and a share serve images below
+MIN_EDGE_PX, to exercise deduplication and validation.
+
+The crawl runs fashion_crawler.main() in a scratch directory holding the
+first --eras eras of research.json. Politeness delays are scaled by
+--politeness (1.0 = production spacing). The report gives queries/s,
+images/s and, per engine, the time spent searching (working), in
+politeness sleeps (sleeping) and idle, plus the mock server's counts.
+
+Usage:
+    python bench_crawler.py                        # 3 eras, 0.1× politeness
+    python bench_crawler.py --eras 12 --politeness 1
+    python bench_crawler.py --latency 0.3 --image-latency 0.5
+    python bench_crawler.py --rate-403 0.05 --rate-429 0.05 --timeout-rate 0.02
+    python bench_crawler.py --image-size 1600x1200 --workdir /tmp/bench
+"""
+import argparse
+import functools
+import html
+import io
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, quote, urlsplit, urlunsplit
+
+import numpy as np
+from PIL import Image
+from requests.adapters import HTTPAdapter
+
+import fashion_crawler as fc
+
+BING_PAGE_SIZE  = 35     # results per Bing async page
+BAIDU_PAGE_SIZE = 30     # results per Baidu acjson page (its rn=30)
+IMAGE_HOSTS     = 8      # distinct fake image hosts result URLs are spread over
+SHARED_IMAGES   = 8      # size of the pool duplicate URLs draw from
+
+LATENCY         = 0.15   # mean seconds per search page (uniform 0.5×–1.5×)
+IMAGE_LATENCY   = 0.25   # mean seconds per image
+RATE_403        = 0.0    # share of requests answered 403
+RATE_429        = 0.0    # share of requests answered 429
+TIMEOUT_RATE    = 0.0    # share of requests that hang past the client timeout
+CLIENT_TIMEOUT  = 2.0    # seconds, replaces ENGINE_TIMEOUTS for the run
+IMAGE_SIZE      = (800, 1000)   # width, height of generated images
+SMALL_SIZE      = (240, 180)    # served for the --small-rate share (< MIN_EDGE_PX)
+SMALL_RATE      = 0.05   # share of images served at SMALL_SIZE
+DUP_RATE        = 0.10   # share of image URLs drawn from the shared pool
+JPEG_QUALITY    = 85
+
+ERAS            = 3      # eras of research.json to crawl
+POLITENESS      = 0.1    # multiplier for INTER_ENGINE_DELAY and the jitter
+SEED            = 1
+
+
+@functools.lru_cache(maxsize=512)
+def render_image(token: str, size: tuple[int, int], quality: int) -> bytes:
+    """Deterministic JPEG for *token*: smooth colour noise, never dark or flat."""
+    width, height = size
+    rng = np.random.default_rng(zlib.crc32(token.encode()))
+    cells = rng.integers(0, 256, (max(1, height // 32), max(1, width // 32), 3), dtype=np.uint8)
+    img = Image.fromarray(cells, "RGB").resize((width, height), Image.BICUBIC)
+    buf = io.BytesIO()
+    img.save(buf, "JPEG", quality=quality)
+    return buf.getvalue()
+
+
+class MockEngineServer(ThreadingHTTPServer):
+    """Local stand-in for Bing, Baidu and the image hosts they link to."""
+
+    daemon_threads = True
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        super().__init__(("127.0.0.1", 0), _MockHandler)
+        self.args = args
+        self.hang = args.client_timeout + 1.0
+        self._lock = threading.Lock()
+        self._attempts: Counter[str] = Counter()
+        self.stats: Counter[tuple[str, str]] = Counter()
+        self.latency = 0.0          # simulated latency served, seconds
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def rng(self, *key) -> random.Random:
+        """Generator seeded by --seed and *key* (a str seed hashes stably)."""
+        return random.Random("\0".join(map(str, (self.args.seed, *key))))
+
+    def attempt(self, url: str) -> int:
+        with self._lock:
+            self._attempts[url] += 1
+            return self._attempts[url]
+
+    def count(self, kind: str, outcome: str, latency: float = 0.0) -> None:
+        with self._lock:
+            self.stats[kind, outcome] += 1
+            self.latency += latency
+
+    def image_url(self, engine: str, query: str, position: int) -> str:
+        rng = self.rng(engine, query, position)
+        if rng.random() < self.args.dup_rate:
+            token = f"shared{rng.randrange(SHARED_IMAGES)}"
+        else:
+            token = f"{engine}{zlib.crc32(query.encode()):08x}_{position}"
+        host = f"img{zlib.crc32(token.encode()) % IMAGE_HOSTS}.mock.test"
+        return f"https://{host}/img/{token}.jpg"
+
+
+class _MockHandler(BaseHTTPRequestHandler):
+    server: MockEngineServer
+    protocol_version = "HTTP/1.1"       # keep-alive, as the real engines
+
+    def log_message(self, format, *args) -> None:  # noqa: A002
+        pass
+
+    def do_GET(self) -> None:  # noqa: N802
+        parts = urlsplit(self.path)
+        if parts.path == "/images/async":
+            kind, latency = "bing", self.server.args.latency
+        elif parts.path == "/search/acjson":
+            kind, latency = "baidu", self.server.args.latency
+        elif parts.path.startswith("/img/"):
+            kind, latency = "image", self.server.args.image_latency
+        else:
+            self._reply(404, "text/plain", b"not found")
+            return
+
+        host = self.headers.get("X-Mock-Host", "")
+        rng = self.server.rng(host, self.path, self.server.attempt(host + self.path))
+        roll = rng.random()
+        args = self.server.args
+        if roll < args.timeout_rate:
+            self.server.count(kind, "timeout")
+            time.sleep(self.server.hang)
+            self.close_connection = True
+            return
+        roll -= args.timeout_rate
+        delay = latency * rng.uniform(0.5, 1.5)
+        time.sleep(delay)
+        for status, rate in ((403, args.rate_403), (429, args.rate_429)):
+            if roll < rate:
+                self.server.count(kind, str(status), delay)
+                self._reply(status, "text/html", b"<html><body>Access denied</body></html>")
+                return
+            roll -= rate
+
+        query = parse_qs(parts.query)
+        if kind == "bing":
+            body = self._bing_page(query["q"][0], int(query.get("first", ["0"])[0]))
+            self._reply(200, "text/html; charset=utf-8", body)
+        elif kind == "baidu":
+            body = self._baidu_page(query["word"][0], int(query.get("pn", ["0"])[0]))
+            self._reply(200, "application/json", body)
+        else:
+            token = Path(parts.path).stem
+            small = self.server.rng("size", token).random() < args.small_rate
+            size = SMALL_SIZE if small else args.image_size
+            self._reply(200, "image/jpeg", render_image(token, size, JPEG_QUALITY))
+        self.server.count(kind, "200", delay)
+
+    def _bing_page(self, query: str, first: int) -> bytes:
+        items = []
+        for pos in range(first, first + BING_PAGE_SIZE):
+            m = json.dumps(
+                {"murl": self.server.image_url("bing", query, pos), "t": f"{query} {pos}"},
+                separators=(",", ":"),
+            )
+            items.append(f'<div class="imgpt"><a class="iusc" m="{html.escape(m)}" href="#"></a></div>')
+        return f"<html><body>{''.join(items)}</body></html>".encode()
+
+    def _baidu_page(self, query: str, pn: int) -> bytes:
+        data = [{"hoverURL": self.server.image_url("baidu", query, pos)}
+                for pos in range(pn, pn + BAIDU_PAGE_SIZE)]
+        return json.dumps({"queryEnc": quote(query), "data": data + [{}]}).encode()
+
+    def _reply(self, status: int, content_type: str, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class MockAdapter(HTTPAdapter):
+    """Send every request to the mock server, keeping its path and query.
+
+    The original host travels in X-Mock-Host, so per-host behaviour on the
+    client (connection pools, download limits) is unchanged.
+    """
+
+    def __init__(self, base_url: str) -> None:
+        super().__init__(pool_connections=fc.POOL_CONNECTIONS, pool_maxsize=fc.POOL_MAXSIZE)
+        self.base = urlsplit(base_url)
+
+    def send(self, request, **kwargs):
+        parts = urlsplit(request.url)
+        request.headers["X-Mock-Host"] = parts.netloc
+        request.url = urlunsplit((self.base.scheme, self.base.netloc, parts.path, parts.query, ""))
+        return super().send(request, **kwargs)
+
+
+def prepare_workdir(workdir: Path, eras: int) -> int:
+    """Write the first *eras* eras of research.json into *workdir*; return the query count."""
+    raw = json.loads((Path(__file__).parent / fc.RESEARCH_FILE).read_text(encoding="utf-8"))
+    selected = (raw if isinstance(raw, list) else raw.get("eras", []))[:eras]
+    (workdir / fc.RESEARCH_FILE).write_text(json.dumps(selected), encoding="utf-8")
+    return sum(len(e.get("icrawler_queries", [])) for e in selected)
+
+
+def count_images(assets: Path) -> int:
+    return sum(1 for p in assets.glob("*/*") if p.suffix.lower() in fc.IMAGE_EXTENSIONS)
+
+
+def run(args: argparse.Namespace, workdir: Path) -> None:
+    total_queries = prepare_workdir(workdir, args.eras)
+    os.chdir(workdir)
+
+    random.seed(args.seed)
+    fc.INTER_ENGINE_DELAY *= args.politeness
+    fc.JITTER_MIN *= args.politeness
+    fc.JITTER_MAX *= args.politeness
+    fc.ERA_WORKERS = args.era_workers
+    if not args.verbose:
+        logging.getLogger("fashion_crawler").setLevel(logging.WARNING)
+
+    server = MockEngineServer(args)
+    threading.Thread(target=server.serve_forever, name="mock-engines", daemon=True).start()
+    for session in fc.SESSIONS.values():
+        session.timeout = args.client_timeout
+        session.trust_env = False           # no proxy between us and 127.0.0.1
+        adapter = MockAdapter(server.base_url)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+
+    assets = Path(fc.ASSETS_DIR)
+    queries_before = fc.open_checkpoint()
+    done_before = queries_before.total_done()
+    queries_before.close()
+    images_before = count_images(assets)
+
+    start = time.perf_counter()
+    try:
+        fc.main(quota=args.quota)
+    finally:
+        wall = time.perf_counter() - start
+        server.shutdown()
+
+    checkpoint = fc.open_checkpoint()
+    queries = checkpoint.total_done() - done_before
+    checkpoint.close()
+    images = count_images(assets) - images_before
+
+    print()
+    print(f"Mock engine benchmark — {args.eras} era(s), {total_queries} queries, "
+          f"{args.era_workers} era worker(s), seed {args.seed}")
+    print(f"  Workdir        : {workdir}")
+    print(f"  Wall time      : {wall:.1f}s")
+    print(f"  Queries        : {queries} completed   ({queries / wall:.2f}/s)")
+    print(f"  Images stored  : {images}   ({images / wall:.2f}/s)")
+    for gate in fc.ENGINE_GATES.values():
+        idle = max(0.0, wall - gate.searching - gate.waited)
+        print(f"  {gate.name:<15}: {gate.queries} searches — working {gate.searching:.1f}s "
+              f"({gate.searching / wall:.0%}), sleeping {gate.waited:.1f}s "
+              f"({gate.waited / wall:.0%}), idle {idle:.1f}s ({idle / wall:.0%})")
+    for kind in ("bing", "baidu", "image"):
+        outcomes = {o: n for (k, o), n in sorted(server.stats.items()) if k == kind}
+        summary = ", ".join(f"{n} × {o}" for o, n in outcomes.items()) or "none"
+        print(f"  Mock {kind:<10}: {summary}")
+    print(f"  Mock latency   : {server.latency:.1f}s simulated across all requests")
+
+
+def _size(text: str) -> tuple[int, int]:
+    width, _, height = text.lower().partition("x")
+    return int(width), int(height)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--eras", type=int, default=ERAS,
+                        help=f"eras of {fc.RESEARCH_FILE} to crawl (default: {ERAS})")
+    parser.add_argument("--era-workers", type=int, default=fc.ERA_WORKERS,
+                        help=f"eras processed concurrently (default: {fc.ERA_WORKERS})")
+    parser.add_argument("--politeness", type=float, default=POLITENESS, metavar="SCALE",
+                        help=f"multiplier for the per-engine delay and jitter (default: {POLITENESS})")
+    parser.add_argument("--quota", type=int, default=fc.ERA_IMAGE_QUOTA, metavar="N",
+                        help="passed through to fashion_crawler --quota")
+    parser.add_argument("--latency", type=float, default=LATENCY, metavar="SECONDS",
+                        help=f"mean search page latency (default: {LATENCY})")
+    parser.add_argument("--image-latency", type=float, default=IMAGE_LATENCY, metavar="SECONDS",
+                        help=f"mean image latency (default: {IMAGE_LATENCY})")
+    parser.add_argument("--rate-403", type=float, default=RATE_403, metavar="P",
+                        help="share of requests answered 403")
+    parser.add_argument("--rate-429", type=float, default=RATE_429, metavar="P",
+                        help="share of requests answered 429")
+    parser.add_argument("--timeout-rate", type=float, default=TIMEOUT_RATE, metavar="P",
+                        help="share of requests that hang past --client-timeout")
+    parser.add_argument("--client-timeout", type=float, default=CLIENT_TIMEOUT, metavar="SECONDS",
+                        help=f"session timeout for both engines (default: {CLIENT_TIMEOUT})")
+    parser.add_argument("--image-size", type=_size, default=IMAGE_SIZE, metavar="WxH",
+                        help="size of generated images (default: %dx%d)" % IMAGE_SIZE)
+    parser.add_argument("--small-rate", type=float, default=SMALL_RATE, metavar="P",
+                        help=f"share of images served at %dx%d (default: {SMALL_RATE})" % SMALL_SIZE)
+    parser.add_argument("--dup-rate", type=float, default=DUP_RATE, metavar="P",
+                        help=f"share of image URLs from a shared pool (default: {DUP_RATE})")
+    parser.add_argument("--seed", type=int, default=SEED)
+    parser.add_argument("--workdir", type=Path,
+                        help="keep outputs here (reused runs resume) instead of a temp dir")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="show the crawler's INFO log on the console")
+    args = parser.parse_args()
+    args.era_workers = max(1, args.era_workers)
+
+    if args.workdir is not None:
+        args.workdir.mkdir(parents=True, exist_ok=True)
+        run(args, args.workdir.resolve())
+    else:
+        cwd = Path.cwd()
+        with tempfile.TemporaryDirectory(prefix="bench_crawler_") as tmp:
+            try:
+                run(args, Path(tmp))
+            finally:
+                os.chdir(cwd)
@@ -4,11 +4,48 @@ Convert the first 5 images of each era folder to WebP.
 Outputs:
   assets/<era>/000001.webp  (full, max 1000px wide, quality 82)
   assets/<era>/thumbs/000001.webp  (thumbnail, max 380px wide, quality 75)
+  assets/<era>/w640/000001.webp    (srcset ladder, one folder per width)
+  src/data/renditions.json         (widths + byte sizes for srcset/sizes)
+  assets/<era>/000001.avif         (--avif: next to any WebP it beats)
+
+Each source is decoded once and every rendition in RENDITIONS is derived
+from that single in-memory image (the thumbnail is downscaled from the
+already-resized full image). Images are converted on a process pool (one
+task per source image, sharded across every era folder), so a full
+re-encode scales with the number of cores.
+
+Builds are incremental: convert_manifest.json records each source's size,
+mtime, SHA-256 and the RENDITIONS it was encoded with. A source is only
+re-encoded when its bytes or the encoder settings change (or an output is
+missing); unchanged stat data short-circuits the hash entirely.
+
+With --avif every rendition is also encoded as AVIF; the AVIF is kept only
+when it is at least AVIF_MIN_SAVING smaller than its WebP, and nginx serves
+it in place of the WebP to browsers that accept image/avif.
+
+With --target-ssim the fixed qualities are replaced by a per-image binary
+search: each rendition gets the lowest WebP quality whose decoded result
+still reaches the target SSIM against the resized original. The chosen
+qualities are cached in the manifest, keyed by the source's content hash.
+
+Usage:
+    python convert_webp.py               # one worker per CPU
+    python convert_webp.py --workers 1   # serial, in-process
+    python convert_webp.py --force       # re-encode all, ignoring freshness
+    python convert_webp.py --avif        # also emit AVIF where it wins
+    python convert_webp.py --target-ssim 0.985
 """
+import argparse
+import hashlib
+import io
+import json
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from PIL import Image
+
+import numpy as np
+from PIL import Image, features
 
 ASSETS_DIR = Path(__file__).parent / "assets"
 FULL_MAX = 1000       # px — longest edge cap for full image
@@ -16,17 +53,166 @@ THUMB_MAX = 380       # px — longest edge cap for thumbnail
 FULL_QUALITY = 82
 THUMB_QUALITY = 75
 IMAGES_PER_ERA = 5    # only convert 000001–000005
+WORKERS = os.cpu_count() or 1   # default process-pool size
+MANIFEST_FILE = Path(__file__).parent / "convert_manifest.json"
+
+# Responsive srcset ladder — extra widths written to assets/<era>/w<width>/.
+# FULL_MAX is already covered by the full image; widths at or above a
+# source's own width are skipped (no upscaling). Set to [] to disable.
+SRCSET_WIDTHS = [320, 480, 640, 1000, 1600]
+SRCSET_FILE = Path(__file__).parent / "src" / "data" / "renditions.json"
+
+# AVIF (--avif). Quality is the rendition's WebP quality plus this delta —
+# AVIF reaches the same visual quality at a much lower setting.
+AVIF_QUALITY_DELTA = -20
+AVIF_SPEED = 6           # 0 (slowest/smallest) … 10 (fastest)
+AVIF_MIN_SAVING = 0.10   # drop the AVIF unless it is ≥10% smaller than the WebP
+
+# Perceptual targeting (--target-ssim). The search probes with a faster
+# encoder method; the final encode still uses method=6.
+QUALITY_MIN = 40
+QUALITY_MAX = 95
+SEARCH_METHOD = 4
+SSIM_WINDOW = 8          # px — side of the square SSIM averaging window
+
+
+# (subfolder under the era dir, longest-edge cap px, WebP quality).
+# Order does not matter — render() works from the largest size down, deriving
+# each rendition from the previous (already downscaled) one.
+RENDITIONS = [
+    ("",       FULL_MAX,  FULL_QUALITY),    # assets/<era>/000001.webp
+    ("thumbs", THUMB_MAX, THUMB_QUALITY),   # assets/<era>/thumbs/000001.webp
+] + [
+    (f"w{w}", w, FULL_QUALITY) for w in SRCSET_WIDTHS if w != FULL_MAX
+]
+LADDER_DIRS = {f"w{w}" for w in SRCSET_WIDTHS}
+
+
+def save_atomic(dest: Path, write) -> None:
+    """Call write(fh) on a temp file beside *dest*, then rename it over *dest*.
+
+    Never writes through an existing inode, so a *dest* hardlinked to
+    another position by fix_bad_images is replaced, not modified in place.
+    """
+    tmp = dest.with_name(f".{dest.name}.tmp")
+    try:
+        with tmp.open("wb") as fh:
+            write(fh)
+        tmp.replace(dest)
+    finally:
+        tmp.unlink(missing_ok=True)
 
 
-def convert(src: Path, dest: Path, max_px: int, quality: int) -> None:
-    dest.parent.mkdir(parents=True, exist_ok=True)
-    with Image.open(src) as img:
+def _box_mean(x: np.ndarray, k: int) -> np.ndarray:
+    """Mean over every k×k window of *x* (valid region only), via an integral image."""
+    c = np.pad(x, ((1, 0), (1, 0))).cumsum(0).cumsum(1)
+    return (c[k:, k:] - c[:-k, k:] - c[k:, :-k] + c[:-k, :-k]) / (k * k)
+
+
+def ssim(a: Image.Image, b: Image.Image) -> float:
+    """Mean structural similarity of two same-sized images, on luma."""
+    x = np.asarray(a.convert("L"), dtype=np.float64)
+    y = np.asarray(b.convert("L"), dtype=np.float64)
+    k = min(SSIM_WINDOW, *x.shape)
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    mx, my = _box_mean(x, k), _box_mean(y, k)
+    vx = _box_mean(x * x, k) - mx * mx
+    vy = _box_mean(y * y, k) - my * my
+    cov = _box_mean(x * y, k) - mx * my
+    s = ((2 * mx * my + c1) * (2 * cov + c2)) / ((mx * mx + my * my + c1) * (vx + vy + c2))
+    return float(s.mean())
+
+
+def search_quality(img: Image.Image, target: float) -> int:
+    """Lowest WebP quality in [QUALITY_MIN, QUALITY_MAX] whose round-trip
+    reaches *target* SSIM against *img* (QUALITY_MAX if none does)."""
+    lo, hi = QUALITY_MIN, QUALITY_MAX
+    while lo < hi:
+        mid = (lo + hi) // 2
+        buf = io.BytesIO()
+        img.save(buf, "WEBP", quality=mid, method=SEARCH_METHOD)
+        buf.seek(0)
+        with Image.open(buf) as probe:
+            if ssim(img, probe) >= target:
+                hi = mid
+            else:
+                lo = mid + 1
+    return lo
+
+
+def render(
+    src: Path,
+    era_dir: Path,
+    stem: str,
+    renditions=RENDITIONS,
+    avif: bool = False,
+    target_ssim: float | None = None,
+    known_qualities: dict[str, int] | None = None,
+    data: bytes | None = None,
+) -> tuple[list[str], list[dict]]:
+    """Decode *src* once and write every rendition of it as WebP (and AVIF).
+
+    *data*, when given, is *src*'s bytes already in memory (the crawler's
+    inline stage); it is decoded instead of re-reading the file.
+
+    Returns (progress_lines, outputs), one output record per file written:
+    {"path": <relative to assets/>, "width": px, "height": px, "quality": q,
+     "bytes": n, "avif_bytes": n | None}. avif_bytes is None when AVIF was not
+    requested or did not beat the WebP by AVIF_MIN_SAVING (any stale .avif is
+    removed).
+
+    With *target_ssim*, each rendition's quality comes from
+    *known_qualities* (keyed by output path) or from search_quality().
+    """
+    known_qualities = known_qualities or {}
+    orig_kb = (len(data) if data is not None else src.stat().st_size) // 1024
+    lines: list[str] = []
+    outputs: list[dict] = []
+    with Image.open(io.BytesIO(data) if data is not None else src) as img:
         img = img.convert("RGB")
-        img.thumbnail((max_px, max_px * 2), Image.LANCZOS)
-        img.save(dest, "WEBP", quality=quality, method=6)
-    orig_kb = src.stat().st_size // 1024
-    new_kb = dest.stat().st_size // 1024
-    print(f"  {src.name} → {dest.relative_to(ASSETS_DIR.parent)}  ({orig_kb}KB → {new_kb}KB)")
+        src_width = img.width
+        for subdir, max_px, quality in sorted(renditions, key=lambda r: -r[1]):
+            dest = era_dir / subdir / f"{stem}.webp"
+            if subdir in LADDER_DIRS and max_px >= src_width:
+                # Not generated for this source — drop any left from another image
+                dest.unlink(missing_ok=True)
+                dest.with_suffix(".avif").unlink(missing_ok=True)
+                continue
+            rel = str(dest.relative_to(ASSETS_DIR))
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            img.thumbnail((max_px, max_px * 2), Image.LANCZOS)
+            if target_ssim is not None:
+                quality = known_qualities.get(rel) or search_quality(img, target_ssim)
+            save_atomic(dest, lambda fh: img.save(fh, "WEBP", quality=quality, method=6))
+            size = dest.stat().st_size
+            line = f"  {src.name} → {dest.relative_to(ASSETS_DIR.parent)}  ({orig_kb}KB → {size // 1024}KB)"
+            if target_ssim is not None:
+                line += f"  q={quality}"
+
+            avif_dest = dest.with_suffix(".avif")
+            avif_bytes = None
+            if avif:
+                buf = io.BytesIO()
+                img.save(buf, "AVIF", quality=quality + AVIF_QUALITY_DELTA, speed=AVIF_SPEED)
+                if buf.tell() <= size * (1 - AVIF_MIN_SAVING):
+                    save_atomic(avif_dest, lambda fh: fh.write(buf.getvalue()))
+                    avif_bytes = buf.tell()
+                    line += f"  +avif {avif_bytes // 1024}KB"
+                else:
+                    line += "  (avif dropped)"
+            if avif_bytes is None:
+                avif_dest.unlink(missing_ok=True)
+
+            outputs.append({
+                "path": rel,
+                "width": img.width,
+                "height": img.height,
+                "quality": quality,
+                "bytes": size,
+                "avif_bytes": avif_bytes,
+            })
+            lines.append(line)
+    return lines, outputs
 
 
 def find_source(folder: Path, n: int) -> Path | None:
@@ -39,31 +225,280 @@ def find_source(folder: Path, n: int) -> Path | None:
     return None
 
 
-total_converted = 0
-total_skipped = 0
+# ─────────────────────────────────────────────────────────────────────────────
+# Build manifest
+#
+# File format (convert_manifest.json), keyed by source path relative to assets/:
+#   {
+#     "01_ancient_egypt_and_mesopotamia/000001.jpg": {
+#       "size": 183204, "mtime_ns": 1718000000000000000, "sha256": "…",
+#       "settings": [["", 1000, 82], ["thumbs", 380, 75], …],
+#       "outputs": [{"path": "01_…/000001.webp", "width": 1000,
+#                    "height": 1333, "quality": 82, "bytes": 91234,
+#                    "avif_bytes": 70310}, ...]
+#     },
+#     ...
+#   }
+# Delete the file (or run with --force) to re-encode everything.
+# ─────────────────────────────────────────────────────────────────────────────
+
+Manifest = dict[str, dict]
+
+
+def load_manifest() -> Manifest:
+    """Load convert_manifest.json.  Returns {} if the file is absent or corrupt."""
+    try:
+        with MANIFEST_FILE.open(encoding="utf-8") as fh:
+            data = json.load(fh)
+    except (FileNotFoundError, json.JSONDecodeError, OSError):
+        return {}
+    return data if isinstance(data, dict) else {}
 
-for era_dir in sorted(ASSETS_DIR.iterdir()):
-    if not era_dir.is_dir():
-        continue
-    print(f"\n[{era_dir.name}]")
-    thumbs_dir = era_dir / "thumbs"
 
-    for n in range(1, IMAGES_PER_ERA + 1):
-        src = find_source(era_dir, n)
-        if src is None:
-            print(f"  {n:06d}: NOT FOUND — skipping")
-            total_skipped += 1
+def save_manifest(manifest: Manifest) -> None:
+    """Write the manifest atomically (temp-file → rename)."""
+    tmp = MANIFEST_FILE.with_suffix(".tmp")
+    tmp.write_text(json.dumps(manifest, indent=2, sort_keys=True), encoding="utf-8")
+    tmp.replace(MANIFEST_FILE)
+
+
+def encoder_settings(
+    renditions=RENDITIONS, avif: bool = False, target_ssim: float | None = None,
+) -> list[list]:
+    """JSON-comparable form of the rendition table stored with each entry."""
+    settings = [list(r) for r in renditions]
+    if avif:
+        settings.append(["avif", AVIF_QUALITY_DELTA, AVIF_SPEED, AVIF_MIN_SAVING])
+    if target_ssim is not None:
+        settings.append(["ssim", target_ssim, QUALITY_MIN, QUALITY_MAX, SEARCH_METHOD, SSIM_WINDOW])
+    return settings
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def is_fresh(entry: dict | None, src: Path, settings: list[list]) -> bool:
+    """True if *src* was already encoded with *settings* and is unchanged.
+
+    Matching size + mtime is trusted without reading the file; otherwise the
+    content hash decides (so a touch or re-download of identical bytes is
+    still a no-op). Refreshes the entry's stat fields on a hash match.
+    """
+    if not entry or entry.get("settings") != settings:
+        return False
+    if not all((ASSETS_DIR / out["path"]).exists() for out in entry.get("outputs", [])):
+        return False
+    st = src.stat()
+    if entry.get("size") == st.st_size and entry.get("mtime_ns") == st.st_mtime_ns:
+        return True
+    if entry.get("size") != st.st_size or entry.get("sha256") != file_sha256(src):
+        return False
+    entry["mtime_ns"] = st.st_mtime_ns
+    return True
+
+
+def convert_one(
+    src: Path,
+    era_dir: Path,
+    stem: str,
+    avif: bool = False,
+    target_ssim: float | None = None,
+    previous: dict | None = None,
+) -> tuple[dict | None, list[str], list[str]]:
+    """Convert one source image into every rendition.
+
+    Runs inside a worker process. Returns (manifest_entry, stdout_lines,
+    stderr_lines) so the parent can print each era's output as one block;
+    manifest_entry is None on failure. *previous* is the source's old
+    manifest entry: its searched qualities are reused when the content hash,
+    the rendition ladder (subdirs and sizes) and the SSIM search settings
+    are all unchanged.
+    """
+    st = src.stat()
+    sha256 = file_sha256(src)
+    settings = encoder_settings(avif=avif, target_ssim=target_ssim)
+    known: dict[str, int] = {}
+    ladder = [list(r) for r in RENDITIONS]
+    if (
+        target_ssim is not None and previous
+        and previous.get("sha256") == sha256
+        and settings[-1] in previous.get("settings", [])
+        and previous["settings"][:len(ladder)] == ladder
+    ):
+        known = {out["path"]: out["quality"] for out in previous.get("outputs", [])
+                 if "quality" in out}
+    try:
+        lines, outputs = render(
+            src, era_dir, stem,
+            avif=avif, target_ssim=target_ssim, known_qualities=known,
+        )
+    except Exception as e:
+        return None, [], [f"  ERROR on {src}: {e}"]
+    entry = {
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "sha256": sha256,
+        "settings": settings,
+        "outputs": outputs,
+    }
+    return entry, lines, []
+
+
+def srcset_outputs(outputs: list[dict]) -> list[dict]:
+    """renditions.json value for one source: full image + ladder, narrowest first."""
+    outs = [
+        {"src": f"/assets/{out['path']}", "width": out["width"], "bytes": out["bytes"]}
+        for out in outputs
+        if Path(out["path"]).parent.name in LADDER_DIRS
+        or len(Path(out["path"]).parts) == 2        # <era>/<stem>.webp
+    ]
+    return sorted(outs, key=lambda o: o["width"])
+
+
+def load_srcset() -> dict[str, list[dict]]:
+    """Load src/data/renditions.json.  Returns {} if the file is absent or corrupt."""
+    try:
+        data = json.loads(SRCSET_FILE.read_text(encoding="utf-8"))
+    except (FileNotFoundError, json.JSONDecodeError, OSError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def write_srcset(srcset: dict[str, list[dict]]) -> None:
+    SRCSET_FILE.parent.mkdir(parents=True, exist_ok=True)
+    tmp = SRCSET_FILE.with_suffix(".tmp")
+    tmp.write_text(json.dumps(srcset, indent=2, sort_keys=True) + "\n", encoding="utf-8")
+    tmp.replace(SRCSET_FILE)
+
+
+def save_srcset(manifest: Manifest, settings: list[list]) -> None:
+    """Write src/data/renditions.json for the Astro components.
+
+    Keyed by "<era>/<stem>"; each value lists the full image and its ladder
+    widths, narrowest first:
+      {"01_…/000001": [{"src": "/assets/01_…/w320/000001.webp",
+                        "width": 320, "bytes": 14210}, ...]}
+    """
+    srcset: dict[str, list[dict]] = {}
+    for key, entry in manifest.items():
+        if entry.get("settings") != settings:
+            continue    # stale entry from an older rendition table
+        outs = srcset_outputs(entry.get("outputs", []))
+        if outs:
+            srcset[str(Path(key).with_suffix(""))] = outs
+    write_srcset(srcset)
+
+
+def _convert_task(task: tuple) -> tuple[dict | None, list[str], list[str]]:
+    return convert_one(*task)
+
+
+def main(
+    workers: int = WORKERS,
+    force: bool = False,
+    avif: bool = False,
+    target_ssim: float | None = None,
+) -> None:
+    # --force still loads the manifest so cached SSIM qualities survive it
+    manifest = load_manifest()
+    settings = encoder_settings(avif=avif, target_ssim=target_ssim)
+
+    # Plan in the parent: missing and up-to-date sources never reach the pool,
+    # so a no-op run costs one stat() per source.
+    plan: list[tuple[Path, int, Path | None, bool]] = []   # (era, n, src, stale)
+    tasks: list[tuple] = []
+    for era_dir in sorted(ASSETS_DIR.iterdir()):
+        if not era_dir.is_dir():
             continue
+        for n in range(1, IMAGES_PER_ERA + 1):
+            src = find_source(era_dir, n)
+            if src is None:
+                plan.append((era_dir, n, None, False))
+                continue
+            previous = manifest.get(str(src.relative_to(ASSETS_DIR)))
+            stale = force or not is_fresh(previous, src, settings)
+            plan.append((era_dir, n, src, stale))
+            if stale:
+                tasks.append((src, era_dir, f"{n:06d}", avif, target_ssim, previous))
+
+    total_converted = 0
+    total_unchanged = 0
+    total_skipped = 0
+
+    if workers > 1 and len(tasks) > 1:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        results = pool.map(_convert_task, tasks)
+    else:
+        pool = None
+        results = map(_convert_task, tasks)
+
+    try:
+        current_era = None
+        # map() yields in submission order, so each era prints as one block
+        for era_dir, n, src, stale in plan:
+            if era_dir != current_era:
+                current_era = era_dir
+                print(f"\n[{era_dir.name}]")
+            if src is None:
+                print(f"  {n:06d}: NOT FOUND — skipping")
+                total_skipped += 1
+                continue
+            if not stale:
+                print(f"  {src.name}: unchanged")
+                total_unchanged += 1
+                continue
+
+            entry, lines, errors = next(results)
+            for line in lines:
+                print(line)
+            for line in errors:
+                print(line, file=sys.stderr)
+            if entry is not None:
+                manifest[str(src.relative_to(ASSETS_DIR))] = entry
+                total_converted += 1
+            else:
+                total_skipped += 1
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        save_manifest(manifest)
+        save_srcset(manifest, settings)
 
-        full_dest = era_dir / f"{n:06d}.webp"
-        thumb_dest = thumbs_dir / f"{n:06d}.webp"
+    print(
+        f"\nDone. Converted: {total_converted}  Unchanged: {total_unchanged}  "
+        f"Skipped/errored: {total_skipped}"
+    )
 
-        try:
-            convert(src, full_dest, FULL_MAX, FULL_QUALITY)
-            convert(src, thumb_dest, THUMB_MAX, THUMB_QUALITY)
-            total_converted += 1
-        except Exception as e:
-            print(f"  ERROR on {src}: {e}", file=sys.stderr)
-            total_skipped += 1
 
-print(f"\nDone. Converted: {total_converted}  Skipped/errored: {total_skipped}")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--workers", type=int, default=WORKERS,
+        help=f"worker processes (default: CPU count, {WORKERS}); 1 = serial",
+    )
+    parser.add_argument(
+        "--force", action="store_true",
+        help="re-encode every source, ignoring convert_manifest.json",
+    )
+    parser.add_argument(
+        "--avif", action="store_true",
+        help="also encode AVIF, kept only where it beats the WebP",
+    )
+    parser.add_argument(
+        "--target-ssim", type=float, metavar="SSIM",
+        help="search per-image WebP quality to reach this SSIM (e.g. 0.985)",
+    )
+    args = parser.parse_args()
+    if args.avif and not features.check("avif"):
+        parser.error("this Pillow build has no AVIF encoder (needs Pillow >= 11.3)")
+    main(
+        workers=max(1, args.workers),
+        force=args.force,
+        avif=args.avif,
+        target_ssim=args.target_ssim,
+    )
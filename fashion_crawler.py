@@ -7,41 +7,99 @@ Automates image collection for the Skirts History research project.
 For each era in research.json, this script:
   1. Creates assets/<era_index>_<slug>/
   2. Runs BingImageCrawler   → 3 images per query
-  3. Waits 3 s (engine-switch delay)
-  4. Runs BaiduImageCrawler  → 3 images per query
-  5. Applies a randomised jitter (2–5 s) before the next query
+  3. Runs BaiduImageCrawler  → 3 images per query
+
+Search and download are decoupled: a query holds its engine only while the
+result page is fetched and parsed into image URLs. The images themselves are
+fetched, validated and stored by an asyncio download stage on a background
+thread (at most HOST_CONCURRENCY requests per image host), so a slow image
+host no longer stalls the next query's search page.
+
+With --process each stored image also passes through an inline stage on a
+process pool: it is scored with audit_images' metrics and, for positions
+000001–000005, converted to its WebP renditions straight from the bytes in
+memory. convert_manifest.json and audit_cache.sqlite3 are updated as it
+goes, so the follow-up convert_webp/audit_images passes skip those files.
+
+Up to ERA_WORKERS eras run concurrently. Politeness is enforced per engine,
+globally, by an EngineGate: an engine serves one query at a time (search
+and downloads), and the next query to it starts no sooner than the old
+one-era-at-a-time cycle allowed — INTER_ENGINE_DELAY, the other engine's
+latest query time and a 2–5 s jitter after the previous one finished —
+while other eras' work overlaps the wait.
 
 Stealth features:
-  - Random User-Agent per crawler instance (pool of 10)
-  - parser_threads=1 / downloader_threads=1 (low-profile throttle)
+  - Random User-Agent per query (pool of 10)
+  - parser_threads=1 and one in-flight download per image host by default
   - Custom Accept-Language + engine-appropriate Referer header
-  - Request jitter between every query cycle
+  - Per-engine request spacing with jitter, shared by all era workers
 
 Usage:
     python fashion_crawler.py
+    python fashion_crawler.py --process             # also score + convert inline
+    python fashion_crawler.py --quota 15            # stop each era at 15 good images
+    python fashion_crawler.py --http-cache          # replay cached pages/images
+    python fashion_crawler.py --offline             # cache only, no network
+    python fashion_crawler.py --import-checkpoint   # merge the JSON file into the store
+    python fashion_crawler.py --export-checkpoint   # write the store back out as JSON
 
 Outputs:
-    assets/<XX>_<slug>/        — sequential icrawler images (000001.jpg …)
+    assets/<XX>_<slug>/        — sequential images (000001.jpg …), hard links into image_store/
+    image_store/               — one copy of every original, named by SHA-256,
+                                 plus manifest.jsonl (era file → blob, source URL)
+    http_cache/                — --http-cache / --offline replay cache (URL → response)
     scrape_status.log          — INFO+ events; WARNING/ERROR for blocks & failures
-    completed_queries.json     — checkpoint; delete to force a full re-run
+    completed_queries.sqlite3  — checkpoint (WAL); delete to force a full re-run
+    completed_queries.json     — JSON checkpoint: imported into the database on
+                                 first run, refreshed by --export-checkpoint
+    era_file_index.json        — last file index used per era, saved with the checkpoint
 
 Resume behaviour:
     Re-running the script skips any query already recorded in the checkpoint.
+    The database also keeps, per query, the engines that returned results,
+    the images stored and when it was first and last completed.
     A query is marked complete once at least one engine fetches images for it.
     Queries where both engines failed (network/block) are left unmarked and
     will be retried on the next run.
-    Delete completed_queries.json to start entirely from scratch.
+    With --quota N an era stops issuing queries once it holds N valid,
+    distinct images; its unrun queries stay unchecked for a later run.
+    Delete completed_queries.sqlite3 (and .json) to start entirely from scratch.
+    Set CHECKPOINT_BACKEND = "journal" for an append-only JSON Lines log
+    instead of the database (completed_queries.jsonl, one fsynced line per
+    query, compacted every JOURNAL_COMPACT_EVERY appends), or "json" to use
+    the JSON file alone, as before.
 """
 
+import argparse
+import asyncio
+import hashlib
+import io
 import json
 import logging
+import multiprocessing
+import os
 import random
 import re
+import sqlite3
 import sys
+import threading
 import time
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
 from pathlib import Path
+from urllib.parse import urlsplit
 
+import audit_images
+import convert_webp
+from image_common import IMAGE_EXTENSIONS, format_extension
+from icrawler import ImageDownloader
 from icrawler.builtin import BaiduImageCrawler, BingImageCrawler
+from icrawler.storage import BaseStorage
+from icrawler.utils import ProxyPool, Session
+from PIL import Image
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Configuration
@@ -51,13 +109,44 @@ RESEARCH_FILE      = "research.json"
 ASSETS_DIR         = "assets"
 LOG_FILE           = "scrape_status.log"
 CHECKPOINT_FILE    = "completed_queries.json"
+CHECKPOINT_DB      = "completed_queries.sqlite3"
+CHECKPOINT_JOURNAL = "completed_queries.jsonl"
+CHECKPOINT_BACKEND = "sqlite"   # "sqlite" (CHECKPOINT_DB), "journal" (CHECKPOINT_JOURNAL)
+                                # or "json" (CHECKPOINT_FILE)
+JOURNAL_COMPACT_EVERY = 500     # journal appends between compactions
+FILE_INDEX_FILE    = "era_file_index.json"  # last file index handed out, per era
+BLOB_DIR           = "image_store"  # content-addressed originals shared by all eras
 
 IMAGES_PER_ENGINE  = 3      # images fetched per engine, per query
-INTER_ENGINE_DELAY = 3      # fixed seconds between Bing → Baidu
-JITTER_MIN         = 2.0    # minimum jitter seconds between query cycles
-JITTER_MAX         = 5.0    # maximum jitter seconds between query cycles
-
-IMAGE_EXTENSIONS   = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp"}
+INTER_ENGINE_DELAY = 3      # fixed part of the per-engine gap between queries
+JITTER_MIN         = 2.0    # minimum jitter seconds added to that gap
+JITTER_MAX         = 5.0    # maximum jitter seconds added to that gap
+ERA_WORKERS        = 3      # eras processed concurrently (1 = one at a time)
+
+URL_OVERFETCH      = 3      # candidate URLs parsed per wanted image (spares for failures)
+HOST_CONCURRENCY   = 1      # simultaneous downloads per image host (1 = today's rate)
+DOWNLOAD_RETRIES   = 3      # attempts per image URL before giving up on it
+MIN_EDGE_PX        = 300    # reject downloads whose shorter side is smaller
+ERA_IMAGE_QUOTA    = 0      # stop an era once it holds this many valid, distinct
+                            # images (0 = off, run every query; see --quota)
+
+PROCESS_INLINE     = False  # score + convert each download in memory (--process)
+PROCESS_WORKERS    = os.cpu_count() or 1   # processes for the inline stage
+
+# One keep-alive session per engine, reused for the whole run. The timeout
+# applies to every request through that session (search pages and images);
+# Baidu's geo-restricted CDN needs a much longer floor than icrawler's 5 s.
+ENGINE_TIMEOUTS    = {"Bing": 5, "Baidu": 20}
+POOL_CONNECTIONS   = 32     # distinct hosts kept alive per engine session
+POOL_MAXSIZE       = 4      # keep-alive connections kept per host
+
+# Optional on-disk replay cache for every GET through SESSIONS (--http-cache).
+# Entries younger than HTTP_CACHE_TTL are served without touching the network;
+# older ones are revalidated with If-None-Match / If-Modified-Since. --offline
+# serves whatever is cached, regardless of age, and fails anything else.
+HTTP_CACHE_DIR     = "http_cache"
+HTTP_CACHE_TTL     = 7 * 24 * 3600     # seconds
+HTTP_CACHE_VARY    = ("Accept", "Accept-Language")   # headers that key an entry
 
 # ─────────────────────────────────────────────────────────────────────────────
 # User-Agent pool — 10 modern browser strings, rotated randomly per instance
@@ -114,11 +203,13 @@ USER_AGENTS: list[str] = [
 # Writes INFO+ to the console and to scrape_status.log.
 # icrawler's own logger (WARNING+) is also routed here, so 403/429 messages
 # from the library's internal downloader appear in the log file automatically.
+# Handlers are installed by main(), so importing this module (e.g. from
+# bench_crawler.py) has no side effects.
 # ─────────────────────────────────────────────────────────────────────────────
 
 def _configure_logging() -> logging.Logger:
     fmt = logging.Formatter(
-        "%(asctime)s [%(levelname)-8s] %(name)s — %(message)s",
+        "%(asctime)s [%(levelname)-8s] %(name)s (%(threadName)s) — %(message)s",
         datefmt="%Y-%m-%d %H:%M:%S",
     )
 
@@ -144,7 +235,7 @@ def _configure_logging() -> logging.Logger:
     return logging.getLogger("fashion_crawler")
 
 
-logger = _configure_logging()
+logger = logging.getLogger("fashion_crawler")
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Utility helpers
@@ -171,19 +262,6 @@ def build_era_folder(era: dict, base: Path) -> Path:
     return folder
 
 
-def count_images(directory: str) -> int:
-    """Return the number of image files already saved in *directory*.
-
-    Passed as `file_idx_offset` to each crawler so sequential filenames
-    (000001.jpg …) never collide across multiple engine / query calls
-    within the same era folder.
-    """
-    return sum(
-        1 for p in Path(directory).iterdir()
-        if p.suffix.lower() in IMAGE_EXTENSIONS
-    )
-
-
 def stealth_headers(referer: str, lang: str = "en-US,en;q=0.9") -> dict[str, str]:
     """Build a randomised stealth header dict for one crawler instance.
 
@@ -196,12 +274,9 @@ def stealth_headers(referer: str, lang: str = "en-US,en;q=0.9") -> dict[str, str
     }
 
 
-def _inject_headers(crawler, headers: dict[str, str]) -> None:
-    """Push custom headers into the crawler's shared requests.Session."""
-    if hasattr(crawler, "session"):
-        crawler.session.headers.update(headers)
-    else:
-        logger.debug("Crawler has no .session attribute — header injection skipped.")
+def _inject_headers(session: Session, headers: dict[str, str]) -> None:
+    """Push custom headers into an engine's shared session (new UA per query)."""
+    session.headers.update(headers)
 
 
 # Substrings that signal an HTTP 403 / 429 rate-limit block
@@ -263,73 +338,1013 @@ def save_checkpoint(checkpoint: Checkpoint) -> None:
         logger.error("Could not save checkpoint: %s", exc)
 
 
-def is_done(checkpoint: Checkpoint, era_key: str, query: str) -> bool:
+def load_file_index() -> dict[str, int]:
+    """Load era_file_index.json.  Returns {} if the file is absent or corrupt."""
+    path = Path(FILE_INDEX_FILE)
+    if not path.exists():
+        return {}
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+        if isinstance(data, dict):
+            return data
+    except (json.JSONDecodeError, OSError) as exc:
+        logger.warning("File index unreadable (%s) — rescanning era folders.", exc)
+    return {}
+
+
+def save_file_index() -> None:
+    """Merge every open era's last index into era_file_index.json (tmp → rename).
+
+    Entries for era folders that no longer exist are dropped.
+    """
+    index = {era: last for era, last in load_file_index().items()
+             if (Path(ASSETS_DIR) / era).is_dir()}
+    with _era_storages_lock:
+        for storage in _era_storages.values():
+            index[storage.root_dir.name] = storage.index.last
+    tmp = Path(FILE_INDEX_FILE).with_suffix(".tmp")
+    try:
+        tmp.write_text(json.dumps(index, indent=2, sort_keys=True), encoding="utf-8")
+        tmp.rename(FILE_INDEX_FILE)
+    except OSError as exc:
+        logger.error("Could not save file index: %s", exc)
+
+
+class JsonCheckpoint:
+    """completed_queries.json, rewritten in full after every query."""
+
+    def __init__(self) -> None:
+        self.data = load_checkpoint()
+        self._done = {era_key: set(queries) for era_key, queries in self.data.items()}
+
+    def is_done(self, era_key: str, query: str) -> bool:
+        return query in self._done.get(era_key, ())
+
+    def mark_done(self, era_key: str, query: str, engines: list[str], images: int) -> None:
+        done = self._done.setdefault(era_key, set())
+        if query not in done:
+            done.add(query)
+            self.data.setdefault(era_key, []).append(query)
+        save_checkpoint(self.data)
+
+    def total_done(self) -> int:
+        return sum(len(v) for v in self._done.values())
+
+    def export(self) -> Checkpoint:
+        return self.data
+
+    def close(self) -> None:
+        pass
+
+
+class SqliteCheckpoint:
+    """Completed queries in SQLite (WAL), one indexed row per (era_key, query).
+
+    mark_done is a single-row upsert, so the cost of a checkpoint no longer
+    grows with the number of queries already done.
+    """
+
+    def __init__(self, path: str = CHECKPOINT_DB) -> None:
+        # Era workers share the connection; writes are serialised by mark_done().
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS queries (
+                era_key      TEXT NOT NULL,
+                query        TEXT NOT NULL,
+                status       TEXT NOT NULL,
+                engines      TEXT,
+                images       INTEGER,
+                first_done   REAL NOT NULL,
+                last_done    REAL NOT NULL,
+                PRIMARY KEY (era_key, query)
+            );
+        """)
+
+    def is_done(self, era_key: str, query: str) -> bool:
+        row = self.db.execute(
+            "SELECT 1 FROM queries WHERE era_key = ? AND query = ? AND status = 'done'",
+            (era_key, query),
+        ).fetchone()
+        return row is not None
+
+    def mark_done(self, era_key: str, query: str, engines: list[str], images: int) -> None:
+        now = time.time()
+        with self.db:
+            self.db.execute(
+                """INSERT INTO queries VALUES (?, ?, 'done', ?, ?, ?, ?)
+                   ON CONFLICT (era_key, query) DO UPDATE SET
+                       status = 'done', engines = excluded.engines,
+                       images = excluded.images, last_done = excluded.last_done""",
+                (era_key, query, ",".join(engines), images, now, now),
+            )
+
+    def total_done(self) -> int:
+        return self.db.execute("SELECT COUNT(*) FROM queries WHERE status = 'done'").fetchone()[0]
+
+    def import_json(self, data: Checkpoint) -> int:
+        """Insert every query in *data* not already present; return how many."""
+        now = time.time()
+        with self.db:
+            before = self.db.total_changes
+            self.db.executemany(
+                "INSERT OR IGNORE INTO queries VALUES (?, ?, 'done', NULL, NULL, ?, ?)",
+                [(k, q, now, now) for k, queries in data.items() for q in queries],
+            )
+            return self.db.total_changes - before
+
+    def export(self) -> Checkpoint:
+        data: Checkpoint = {}
+        for era_key, query in self.db.execute(
+            "SELECT era_key, query FROM queries WHERE status = 'done' ORDER BY era_key, first_done, rowid"
+        ):
+            data.setdefault(era_key, []).append(query)
+        return data
+
+    def close(self) -> None:
+        self.db.close()
+
+
+class JournalCheckpoint:
+    """Completed queries as an append-only JSON Lines journal.
+
+    mark_done appends one line and fsyncs it — O(1) per query, and as
+    crash-safe as the old tmp-rename: a kill mid-append leaves at most one
+    torn last line, which replay skips. Loading replays the journal into
+    set indexes. Every JOURNAL_COMPACT_EVERY appends (and on close) the
+    journal is rewritten with one line per query via tmp → rename.
+    """
+
+    def __init__(self, path: str = CHECKPOINT_JOURNAL) -> None:
+        self.path = Path(path)
+        self.records: dict[tuple[str, str], dict] = {}
+        self._done: dict[str, set[str]] = {}
+        self._appends = 0
+        torn = self.path.exists() and self._replay()
+        self._fh = self.path.open("a", encoding="utf-8")
+        if torn:
+            self.compact()      # never append after a torn line
+
+    def _replay(self) -> bool:
+        """Load every readable line; True if any line had to be skipped."""
+        torn = False
+        with self.path.open(encoding="utf-8") as fh:
+            for lineno, line in enumerate(fh, start=1):
+                try:
+                    record = json.loads(line)
+                    key = (record["era_key"], record["query"])
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    logger.warning("Checkpoint journal line %d unreadable — ignored.", lineno)
+                    torn = True
+                    continue
+                self.records[key] = record
+                self._done.setdefault(key[0], set()).add(key[1])
+                self._appends += 1
+        self._appends -= len(self.records)     # lines a compaction would drop
+        return torn
+
+    def _append(self, record: dict) -> None:
+        key = (record["era_key"], record["query"])
+        self.records[key] = record
+        self._done.setdefault(key[0], set()).add(key[1])
+        self._fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._fh.flush()
+        os.fsync(self._fh.fileno())
+        self._appends += 1
+        if self._appends >= JOURNAL_COMPACT_EVERY:
+            self.compact()
+
+    def is_done(self, era_key: str, query: str) -> bool:
+        return query in self._done.get(era_key, ())
+
+    def mark_done(self, era_key: str, query: str, engines: list[str], images: int) -> None:
+        self._append({
+            "era_key": era_key, "query": query, "engines": engines,
+            "images": images, "done": time.time(),
+        })
+
+    def total_done(self) -> int:
+        return len(self.records)
+
+    def import_json(self, data: Checkpoint) -> int:
+        imported = 0
+        for era_key, queries in data.items():
+            for query in queries:
+                if not self.is_done(era_key, query):
+                    self._append({"era_key": era_key, "query": query, "done": time.time()})
+                    imported += 1
+        return imported
+
+    def export(self) -> Checkpoint:
+        data: Checkpoint = {}
+        for era_key, query in self.records:
+            data.setdefault(era_key, []).append(query)
+        return data
+
+    def compact(self) -> None:
+        """Rewrite the journal with one line per query (tmp → fsync → rename)."""
+        tmp = self.path.with_suffix(".tmp")
+        with tmp.open("w", encoding="utf-8") as fh:
+            for record in self.records.values():
+                fh.write(json.dumps(record, ensure_ascii=False) + "\n")
+            fh.flush()
+            os.fsync(fh.fileno())
+        self._fh.close()
+        tmp.replace(self.path)
+        self._fh = self.path.open("a", encoding="utf-8")
+        self._appends = 0
+
+    def close(self) -> None:
+        if self._appends:
+            self.compact()
+        self._fh.close()
+
+
+CheckpointStore = JsonCheckpoint | SqliteCheckpoint | JournalCheckpoint
+
+CHECKPOINT_PATHS = {
+    "sqlite": CHECKPOINT_DB, "journal": CHECKPOINT_JOURNAL, "json": CHECKPOINT_FILE,
+}
+
+
+def _open_store() -> CheckpointStore:
+    if CHECKPOINT_BACKEND == "json":
+        return JsonCheckpoint()
+    if CHECKPOINT_BACKEND == "journal":
+        return JournalCheckpoint()
+    return SqliteCheckpoint()
+
+
+def open_checkpoint() -> CheckpointStore:
+    """Open the CHECKPOINT_BACKEND store, importing the JSON file into an empty one."""
+    store = _open_store()
+    if (CHECKPOINT_BACKEND != "json" and store.total_done() == 0
+            and Path(CHECKPOINT_FILE).exists()):
+        imported = store.import_json(load_checkpoint())
+        logger.info("Imported %d completed quer%s from %s.",
+                    imported, "y" if imported == 1 else "ies", CHECKPOINT_FILE)
+    return store
+
+
+def is_done(checkpoint: CheckpointStore, era_key: str, query: str) -> bool:
     """Return True if *query* is already recorded as complete for *era_key*."""
-    return query in checkpoint.get(era_key, [])
+    return checkpoint.is_done(era_key, query)
 
 
-def mark_done(checkpoint: Checkpoint, era_key: str, query: str) -> None:
+_checkpoint_lock = threading.Lock()   # era workers share one checkpoint
+
+
+def mark_done(
+    checkpoint: CheckpointStore,
+    era_key: str,
+    query: str,
+    engines: list[str],
+    images: int,
+) -> None:
     """Record *query* as complete and flush the checkpoint to disk immediately."""
-    completed = checkpoint.setdefault(era_key, [])
-    if query not in completed:
-        completed.append(query)
-    save_checkpoint(checkpoint)
+    with _checkpoint_lock:
+        checkpoint.mark_done(era_key, query, engines, images)
+        save_file_index()
 
 
 # ─────────────────────────────────────────────────────────────────────────────
-# Engine runners
+# Politeness scheduler — one gate per engine, shared by every era worker
 # ─────────────────────────────────────────────────────────────────────────────
 
-def crawl_bing(query: str, save_dir: str, file_idx_offset: int) -> None:
-    """Fetch IMAGES_PER_ENGINE images from Bing for a single query."""
-    crawler = BingImageCrawler(
-        storage={"root_dir": save_dir},
-        parser_threads=1,
-        downloader_threads=1,
-    )
-    _inject_headers(crawler, stealth_headers("https://www.bing.com/"))
-    crawler.crawl(
-        keyword=query,
-        max_num=IMAGES_PER_ENGINE,
-        file_idx_offset=file_idx_offset,
-    )
+# Set by main() when the run is aborting (Ctrl-C or a failed era): era
+# workers stop before their next query and politeness sleeps end early.
+_STOP = threading.Event()
+
+
+class RunStopping(Exception):
+    """Raised by EngineGate.slot() instead of starting a query once _STOP is set."""
 
 
-def _extend_session_timeout(crawler, seconds: int = 20) -> None:
-    """Wrap session.send so every request uses at least *seconds* as timeout.
+class EngineGate:
+    """Hold one engine to the query rate of the old sequential loop.
 
-    Baidu's CDN is geo-restricted; icrawler's default 5 s connect timeout
-    causes frequent first-attempt failures that burn retries and add ~30 s
-    per Baidu call. This patch raises the floor without touching icrawler internals.
+    That loop ran Bing (search + downloads), slept INTER_ENGINE_DELAY, ran
+    Baidu, then slept a JITTER_MIN–JITTER_MAX jitter, so each engine saw one
+    query per (its own work + the delay + the other engine's work + jitter).
+    The gate enforces that start-to-start interval per engine, globally:
+    one query per engine is in progress at a time, counted from its search
+    until its downloads have finished, and the next may start only after
+    the delay, the partner engine's latest work time and a fresh jitter
+    have passed on top. Other eras' work overlaps the wait.
     """
-    if not hasattr(crawler, "session"):
-        return
-    original_send = crawler.session.send
 
-    def _send(request, **kwargs):
-        kwargs["timeout"] = seconds
-        return original_send(request, **kwargs)
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.partner: EngineGate | None = None
+        self._cond = threading.Condition()
+        self._busy = False          # a query is searching or downloading
+        self._next_start = 0.0      # time.monotonic() of the earliest next start
+        self.last_work = 0.0        # seconds the latest query took, search + downloads
+        self.queries = 0            # run totals, logged by main()
+        self.searching = 0.0        # seconds spent fetching result pages
+        self.waited = 0.0           # seconds spent in politeness sleeps
+
+    @contextmanager
+    def slot(self):
+        """Wait for the engine's turn.
+
+        Yields a function that takes the query's download Future; the turn
+        ends when that resolves, or on leaving the block if none is given.
+        Raises RunStopping, without touching the engine, if the run is
+        stopping by the time the turn comes.
+        """
+        with self._cond:
+            while self._busy:
+                self._cond.wait()
+            self._busy = True
+        downloads: list[Future] = []
+        start = time.monotonic()
+        wait = self._next_start - start
+        if wait > 0:
+            logger.info("      [%s] Politeness wait %.2fs...", self.name, wait)
+            _STOP.wait(wait)
+            self.waited += time.monotonic() - start
+        if _STOP.is_set():
+            with self._cond:
+                self._busy = False
+                self._cond.notify()
+            raise RunStopping(self.name)
+        start = time.monotonic()
+        try:
+            yield downloads.append
+        finally:
+            self.queries += 1
+            self.searching += time.monotonic() - start
+            if downloads:
+                downloads[0].add_done_callback(lambda _: self._release(start))
+            else:
+                self._release(start)
+
+    def _release(self, start: float) -> None:
+        now = time.monotonic()
+        with self._cond:
+            self.last_work = now - start
+            partner_work = self.partner.last_work if self.partner is not None else 0.0
+            self._next_start = (
+                now
+                + INTER_ENGINE_DELAY
+                + partner_work
+                + random.uniform(JITTER_MIN, JITTER_MAX)
+            )
+            self._busy = False
+            self._cond.notify()
+
+
+ENGINE_GATES = {"Bing": EngineGate("Bing"), "Baidu": EngineGate("Baidu")}
+ENGINE_GATES["Bing"].partner = ENGINE_GATES["Baidu"]
+ENGINE_GATES["Baidu"].partner = ENGINE_GATES["Bing"]
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Content-addressed store — every original kept once, era files link to it
+# ─────────────────────────────────────────────────────────────────────────────
+
+class BlobStore:
+    """SHA-256 content-addressed store for crawled originals.
+
+    Blobs live at <root>/<first 2 hex>/<sha256><ext>. The set of digests
+    already in the archive — every blob plus any era image that predates the
+    store — is built on first use, so bytes seen before (the same picture
+    from Bing and Baidu, or from two queries) are never written again.
+    manifest.jsonl gets one line per era file linked to a blob.
+    """
+
+    def __init__(self, root: Path, assets: Path) -> None:
+        self.root = root
+        self.assets = assets
+        self._lock = threading.Lock()
+        self._known: set[str] | None = None
+
+    def _scan(self) -> set[str]:
+        known = {p.stem for p in self.root.glob("??/*") if p.is_file()}
+        for p in self.assets.glob("*/*"):
+            if (p.suffix.lower() in IMAGE_EXTENSIONS and not p.is_symlink()
+                    and p.stat().st_nlink == 1):
+                known.add(convert_webp.file_sha256(p))
+        return known
+
+    def claim(self, data: bytes) -> str | None:
+        """Return the digest of *data*, or None if the archive already has it.
+
+        The digest counts as archived from here on, so concurrent downloads
+        of the same bytes store them once; release() it if storing fails.
+        """
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if self._known is None:
+                self._known = self._scan()
+            if digest in self._known:
+                return None
+            self._known.add(digest)
+        return digest
+
+    def release(self, digest: str) -> None:
+        """Undo claim() for bytes that never made it into the archive."""
+        with self._lock:
+            if self._known is not None:
+                self._known.discard(digest)
+
+    def write(self, digest: str, data: bytes, ext: str) -> Path:
+        blob = self.root / digest[:2] / f"{digest}{ext}"
+        if not blob.exists():
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            tmp = blob.with_name(f".{blob.name}.tmp")
+            tmp.write_bytes(data)
+            tmp.replace(blob)
+        return blob
+
+    def record(self, path: Path, digest: str, url: str) -> None:
+        line = json.dumps({"path": path.as_posix(), "sha256": digest, "url": url})
+        with self._lock, (self.root / "manifest.jsonl").open("a", encoding="utf-8") as fh:
+            fh.write(line + "\n")
+
+
+BLOBS = BlobStore(Path(BLOB_DIR), Path(ASSETS_DIR))
+
+
+class EraIndex:
+    """Hands out file indices for one era folder without rescanning it.
+
+    The folder is scanned once, when the era starts; after that allocate()
+    is a locked counter bump, so concurrent downloads never collide. The
+    scan, not FILE_INDEX_FILE, decides where numbering resumes: files
+    deleted since the last run (or a wiped era folder) free their indices
+    again, so a re-crawl starts back at 000001.
+    """
+
+    def __init__(self, folder: Path) -> None:
+        self._lock = threading.Lock()
+        self.last = max([0] + [int(p.stem) for p in folder.iterdir() if p.stem.isdigit()])
+
+    def allocate(self) -> int:
+        with self._lock:
+            self.last += 1
+            return self.last
+
+
+def validate_image(data: bytes) -> tuple[str | None, str]:
+    """Vet downloaded bytes before they are stored.
+
+    Returns (extension, "") for an acceptable image, else (None, reason).
+    Uses audit_images' TINY/DARK/FLAT thresholds on a reduced decode, plus
+    MIN_EDGE_PX on the header dimensions, so images the audit would flag
+    never reach the archive.
+    """
+    if len(data) < audit_images.TINY_BYTES:
+        return None, f"TINY ({len(data)} B)"
+    try:
+        with Image.open(io.BytesIO(data)) as img:
+            fmt = img.format
+            width, height = img.size
+        ext = format_extension(fmt)
+        if ext is None:
+            return None, f"UNSUPPORTED ({(fmt or 'unknown').lower()})"
+        if min(width, height) < MIN_EDGE_PX:
+            return None, f"SMALL ({width}×{height})"
+        rgb = audit_images.load_reduced(io.BytesIO(data))
+    except Exception:  # noqa: BLE001 — truncated / not an image
+        return None, "UNREADABLE"
+    flags = audit_images.flag_image(len(data), audit_images.compute_metrics(rgb))
+    if flags:
+        return None, "/".join(flags)
+    return ext, ""
+
+
+class BlobStorage(BaseStorage):
+    """icrawler storage backend for one era folder, backed by BLOBS.
+
+    Files are hard links to their blob (symlinks where the store sits on
+    another filesystem), so convert_webp/audit_images read them as before.
+    Every write is vetted by validate_image() first.
+    """
 
-    crawler.session.send = _send
+    def __init__(self, root_dir: str, index: EraIndex) -> None:
+        self.root_dir = Path(root_dir)
+        self.index = index
+        self.quota: EraQuota | None = None     # set by process_era in quota mode
 
+    def write(self, id, data):
+        if validate_image(data)[0] is None:
+            return
+        digest = BLOBS.claim(data)
+        if digest is not None:
+            self._link(id, digest, data, "")
+
+    def exists(self, id):
+        return (self.root_dir / id).exists()
+
+    def max_file_idx(self):
+        return self.index.last
+
+    def _link(self, name: str, digest: str, data: bytes, url: str) -> None:
+        dest = self.root_dir / name
+        try:
+            blob = BLOBS.write(digest, data, Path(name).suffix)
+            try:
+                os.link(blob, dest)
+            except OSError:
+                dest.symlink_to(os.path.relpath(blob, dest.parent))
+        except BaseException:
+            BLOBS.release(digest)   # so a later download of it is stored
+            raise
+        BLOBS.record(dest, digest, url)
+
+    def add(self, data: bytes, url: str = "") -> tuple[str | None, str]:
+        """Store *data* under the next free index.
+
+        Returns (filename, "") or, if it was rejected, (None, reason).
+        Invalid images and duplicates are caught before an index is
+        allocated, so they never consume one.
+        """
+        ext, reason = validate_image(data)
+        if ext is None:
+            return None, reason
+        digest = BLOBS.claim(data)
+        if digest is None:
+            return None, "duplicate — already archived"
+        name = f"{self.index.allocate():06d}{ext}"
+        self._link(name, digest, data, url)
+        if self.quota is not None:
+            self.quota.admit(data)
+        return name, ""
+
+
+class EraQuota:
+    """Counts an era's valid, distinct images towards ERA_IMAGE_QUOTA.
+
+    Seeded at era start from the images already in the folder that pass
+    validate_image(); then every stored download is admitted as it lands.
+    An image only counts if its dHash is more than audit_images.DUP_DISTANCE
+    from everything counted so far, so near-duplicates (including a WebP
+    rendition next to its original) are counted once.
+    """
+
+    def __init__(self, folder: Path, target: int) -> None:
+        self.target = target
+        self.count = 0
+        self._lock = threading.Lock()
+        self._seen = audit_images.BKTree()
+        for p in sorted(folder.iterdir()):
+            if p.is_file() and p.suffix.lower() in IMAGE_EXTENSIONS:
+                data = p.read_bytes()
+                if validate_image(data)[0] is not None:
+                    self.admit(data)
+
+    def admit(self, data: bytes) -> bool:
+        """Count *data* unless it near-duplicates a counted image."""
+        h = audit_images.dhash(audit_images.load_reduced(io.BytesIO(data)))
+        with self._lock:
+            if self._seen.search(h, audit_images.DUP_DISTANCE):
+                return False
+            self._seen.add(h, self.count)
+            self.count += 1
+            return True
+
+    @property
+    def met(self) -> bool:
+        return self.count >= self.target
+
+
+_era_storages: dict[str, BlobStorage] = {}
+_era_storages_lock = threading.Lock()
+
+
+def open_era_storage(folder: Path) -> BlobStorage:
+    """Build *folder*'s EraIndex and storage once, at era start."""
+    with _era_storages_lock:
+        save_dir = str(folder)
+        if save_dir not in _era_storages:
+            index = EraIndex(folder)
+            recorded = load_file_index().get(folder.name)
+            if recorded is not None and recorded != index.last:
+                logger.info("    File index for '%s' said %d, folder holds %d — using the folder.",
+                            folder.name, recorded, index.last)
+            _era_storages[save_dir] = BlobStorage(save_dir, index)
+        return _era_storages[save_dir]
+
+
+def era_storage(save_dir: str) -> BlobStorage:
+    """Return the BlobStorage opened for *save_dir* by process_era."""
+    with _era_storages_lock:
+        return _era_storages[save_dir]
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Download stage — asyncio loop on a background thread, shared by all eras
+# ─────────────────────────────────────────────────────────────────────────────
+
+class AsyncDownloader:
+    """Fetch, validate and store image URLs off the search path.
+
+    Each submit() schedules one job on a private event loop and returns a
+    concurrent Future resolving to the filenames stored. A job runs one task
+    per wanted image (*quota* of them), each taking the next candidate URL
+    until it has stored an image, so a spare URL is only fetched after an
+    earlier one failed or was rejected and at most *quota* images are
+    stored. Across all jobs, at most HOST_CONCURRENCY requests hit any one
+    host at a time. requests is blocking, so each GET runs in the loop's
+    default executor. With a processor attached, each stored image is
+    handed to the inline stage as a separate task, so the job (and the
+    engine turn waiting on it) resolves as soon as its images are stored;
+    drain() waits for an era's inline work.
+    """
+
+    def __init__(self) -> None:
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._start_lock = threading.Lock()
+        self._host_limits: dict[str, asyncio.Semaphore] = {}
+        self.processor: InlineProcessor | None = None     # set by main(--process)
+        self._processing: dict[str, set[asyncio.Task]] = {}  # era folder name → inline tasks
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        with self._start_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(
+                    target=self._loop.run_forever, name="downloads", daemon=True,
+                ).start()
+            return self._loop
+
+    def submit(self, urls: list[str], session, storage: BlobStorage, quota: int) -> Future:
+        coro = self._job(urls, session, storage, quota)
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def close(self) -> None:
+        """Cancel every unfinished job, then stop the loop.
+
+        Each Future submit() returned is resolved by the time this returns
+        (cancelled if its job had not finished), so nothing waiting on one
+        can block on the stopped loop.
+        """
+        if self._loop is None:
+            return
+
+        async def cancel_all() -> None:
+            jobs = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for job in jobs:
+                job.cancel()
+            await asyncio.gather(*jobs, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(cancel_all(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+    def drain(self, era_key: str) -> None:
+        """Block until the inline stage has finished every image stored so
+        far in the era folder named *era_key*."""
+        if self._loop is None or self.processor is None:
+            return
+
+        async def wait_all() -> None:
+            while tasks := [t for t in self._processing.get(era_key, ()) if not t.done()]:
+                await asyncio.wait(tasks)
+
+        asyncio.run_coroutine_threadsafe(wait_all(), self._loop).result()
+
+    async def _job(self, urls: list[str], session, storage: BlobStorage, quota: int) -> list[str]:
+        loop = asyncio.get_running_loop()
+        stored: list[str] = []
+        candidates = iter(urls)
+
+        async def one_image() -> None:
+            # Take candidates in turn until one is stored, so a spare URL is
+            # only fetched once an earlier attempt failed or was rejected
+            for url in candidates:
+                host = urlsplit(url).netloc
+                limit = self._host_limits.setdefault(host, asyncio.Semaphore(HOST_CONCURRENCY))
+                async with limit:
+                    data = await self._fetch(url, session)
+                if data is None:
+                    continue
+                name, reason = await loop.run_in_executor(None, storage.add, data, url)
+                if name is None:
+                    logger.info("      Rejected: %s — %s", reason, url)
+                    continue
+                stored.append(name)
+                logger.debug("      stored %s/%s ← %s", storage.root_dir, name, url)
+                if self.processor is not None:
+                    task = loop.create_task(
+                        self.processor.process(storage.root_dir.resolve() / name, data)
+                    )
+                    tasks = self._processing.setdefault(storage.root_dir.name, set())
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                return
+
+        await asyncio.gather(*(one_image() for _ in range(min(quota, len(urls)))))
+        return stored
+
+    async def _fetch(self, url: str, session) -> bytes | None:
+        loop = asyncio.get_running_loop()
+        for attempt in range(DOWNLOAD_RETRIES, 0, -1):
+            try:
+                response = await loop.run_in_executor(
+                    None, session.get, url,
+                )
+            except OfflineMiss:
+                logger.debug("      Not cached, skipped offline: %s", url)
+                return None     # retrying cannot change the answer
+            except Exception as exc:  # noqa: BLE001
+                logging.getLogger("icrawler.downloader").error(
+                    "Exception caught when downloading file %s, error: %s, "
+                    "remaining retry times: %d", url, exc, attempt - 1,
+                )
+                continue
+            if response.status_code != 200:
+                logging.getLogger("icrawler.downloader").error(
+                    "Response status code %d, file %s", response.status_code, url,
+                )
+                return None
+            return response.content
+        return None
+
+
+DOWNLOADS = AsyncDownloader()
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Inline post-download stage (--process) — score and convert from memory
+# ─────────────────────────────────────────────────────────────────────────────
+
+def process_download(path: Path, data: bytes) -> tuple[str, dict, dict | None, tuple | None]:
+    """Hash, score and (for positions 1–IMAGES_PER_ERA) convert one download.
+
+    Runs in a worker process on the bytes still in memory. Returns (sha256,
+    audit result for *path*, convert_manifest entry or None, (audit result,
+    sha256) for the full WebP or None).
+    """
+    sha256 = hashlib.sha256(data).hexdigest()
+    rgb = audit_images.load_reduced(io.BytesIO(data))
+    audit = audit_images.audit_result(path.parent.name, path.name, len(data), rgb)
+    if (int(path.stem) > convert_webp.IMAGES_PER_ERA
+            or path.suffix.lower() not in (".jpg", ".jpeg", ".png")):
+        return sha256, audit, None, None
+    _, outputs = convert_webp.render(path, path.parent, path.stem, data=data)
+    st = path.stat()
+    entry = {
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "sha256": sha256,
+        "settings": convert_webp.encoder_settings(),
+        "outputs": outputs,
+    }
+    return sha256, audit, entry, audit_images._audit_task(path.with_suffix(".webp"))
 
-def crawl_baidu(query: str, save_dir: str, file_idx_offset: int) -> None:
-    """Fetch IMAGES_PER_ENGINE images from Baidu for a single query."""
-    crawler = BaiduImageCrawler(
-        storage={"root_dir": save_dir},
+
+class InlineProcessor:
+    """Post-download stage: every stored image is scored (audit_images
+    metrics) and, if it is one of the first IMAGES_PER_ERA, converted to its
+    full/thumb/srcset WebP renditions straight from the downloaded bytes.
+
+    Work runs on a process pool while the crawl carries on, so it overlaps
+    the politeness waits. Results go into audit_cache.sqlite3 and
+    convert_manifest.json, so a later audit_images/convert_webp run finds
+    them fresh instead of re-reading the asset tree.
+    """
+
+    def __init__(self, workers: int = PROCESS_WORKERS) -> None:
+        # spawn: the crawler is multi-threaded, and fork would copy held locks
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+        )
+        self._lock = threading.Lock()   # serialises manifest / cache writes
+
+    async def process(self, path: Path, data: bytes) -> None:
+        try:
+            sha256, audit, entry, webp_audit = await asyncio.wrap_future(
+                self.pool.submit(process_download, path, data)
+            )
+        except Exception as exc:  # noqa: BLE001
+            logger.error("      Inline processing failed for %s — left for "
+                         "convert_webp/audit_images. (%s)", path, exc)
+            return
+        await asyncio.get_running_loop().run_in_executor(
+            None, self._record, path, sha256, audit, entry, webp_audit,
+        )
+
+    def _record(self, path: Path, sha256: str, audit: dict,
+                entry: dict | None, webp_audit: tuple | None) -> None:
+        with self._lock:
+            cache = audit_images.AuditCache()
+            try:
+                cache.put(path, sha256, audit)
+                if webp_audit is not None:
+                    cache.put(path.with_suffix(".webp"), webp_audit[1], webp_audit[0])
+            finally:
+                cache.close()
+            if entry is not None:
+                key = path.relative_to(convert_webp.ASSETS_DIR)
+                manifest = convert_webp.load_manifest()
+                manifest[str(key)] = entry
+                convert_webp.save_manifest(manifest)
+                # Merge into renditions.json rather than rebuilding it from
+                # the manifest, which would drop sources with other settings.
+                outs = convert_webp.srcset_outputs(entry["outputs"])
+                if outs:
+                    srcset = convert_webp.load_srcset()
+                    srcset[str(key.with_suffix(""))] = outs
+                    convert_webp.write_srcset(srcset)
+        logger.info("      Processed %s/%s%s", path.parent.name, path.name,
+                    " → WebP" if entry is not None else "")
+
+    def close(self) -> None:
+        self.pool.shutdown()
+
+
+class _URLCollector(ImageDownloader):
+    """icrawler downloader that records result URLs instead of fetching them.
+
+    Stops the crawl (via icrawler's reach_max_num signal) as soon as the
+    parser has produced max_num URLs, so the engine is released right after
+    its result page.
+    """
+
+    def __init__(self, *args, sink: list[str], **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.sink = sink
+
+    def download(self, task, default_ext, timeout=5, max_retry=3, overwrite=False, **kwargs):
+        with self.lock:
+            if self.reach_max_num():
+                self.signal.set(reach_max_num=True)
+                return False
+            self.fetched_num += 1
+            self.sink.append(task["file_url"])
+            if self.reach_max_num():
+                self.signal.set(reach_max_num=True)
+        return True
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Session pool — one long-lived, keep-alive session per engine
+# ─────────────────────────────────────────────────────────────────────────────
+
+class OfflineMiss(requests.ConnectionError):
+    """Raised for an --offline GET of a URL the replay cache does not hold."""
+
+
+class HTTPReplayCache:
+    """On-disk cache of successful GET responses, for development re-runs.
+
+    An entry is keyed by the URL plus the HTTP_CACHE_VARY request headers
+    (not the rotating User-Agent) and stored as <key>.json (status, headers,
+    validators, time stored) next to <key>.body under <root>/<first 2 hex>/.
+    Only 200 responses are stored.
+    """
+
+    def __init__(self, root: Path, ttl: float = HTTP_CACHE_TTL, offline: bool = False) -> None:
+        self.root = root
+        self.ttl = ttl
+        self.offline = offline
+        self.hits = self.revalidated = self.misses = 0
+
+    def _paths(self, url: str, headers) -> tuple[Path, Path]:
+        vary = [(h, headers.get(h, "")) for h in HTTP_CACHE_VARY]
+        key = hashlib.sha256(json.dumps([url, vary]).encode()).hexdigest()
+        base = self.root / key[:2] / key
+        return base.with_suffix(".json"), base.with_suffix(".body")
+
+    def get(self, session: requests.Session, url: str, send, **kwargs) -> requests.Response:
+        """Serve *url* from the cache, revalidating or calling *send* as needed."""
+        headers = CaseInsensitiveDict(session.headers)
+        headers.update(kwargs.get("headers") or {})
+        meta_path, body_path = self._paths(url, headers)
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            body = body_path.read_bytes()
+        except (OSError, json.JSONDecodeError):
+            meta = body = None
+
+        if meta is not None and (self.offline or time.time() - meta["stored"] < self.ttl):
+            self.hits += 1
+            return self._response(url, meta, body)
+        if self.offline:
+            raise OfflineMiss(f"offline: {url} is not in {self.root}")
+
+        if meta is not None:
+            conditional = {}
+            if meta.get("etag"):
+                conditional["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                conditional["If-Modified-Since"] = meta["last_modified"]
+            kwargs["headers"] = {**(kwargs.get("headers") or {}), **conditional}
+        response = send(**kwargs)
+        if response.status_code == 304 and meta is not None:
+            self.revalidated += 1
+            meta["stored"] = time.time()
+            self._write(meta_path, json.dumps(meta).encode())
+            return self._response(url, meta, body)
+        self.misses += 1
+        if response.status_code == 200:
+            meta = {
+                "url": url,
+                "status": 200,
+                "headers": dict(response.headers),
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+                "stored": time.time(),
+            }
+            self._write(body_path, response.content)
+            self._write(meta_path, json.dumps(meta).encode())
+        return response
+
+    @staticmethod
+    def _write(path: Path, data: bytes) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+        tmp.write_bytes(data)
+        tmp.replace(path)
+
+    @staticmethod
+    def _response(url: str, meta: dict, body: bytes) -> requests.Response:
+        response = requests.Response()
+        response.status_code = meta["status"]
+        response.headers = CaseInsensitiveDict(meta["headers"])
+        response._content = body
+        response.url = url
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        return response
+
+
+class PooledSession(Session):
+    """icrawler Session with a fixed timeout and a sized connection pool.
+
+    Shared by every crawler, and by the download stage, for one engine, so
+    TLS handshakes and DNS lookups are paid once per host per run rather
+    than once per query. With a cache attached, GETs go through it.
+    """
+
+    def __init__(self, timeout: float) -> None:
+        super().__init__(ProxyPool())
+        self.timeout = timeout
+        self.cache: HTTPReplayCache | None = None     # set by main(--http-cache)
+        adapter = HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        kwargs["timeout"] = self.timeout
+        if self.cache is None or method.upper() != "GET":
+            return super().request(method, url, **kwargs)
+        send = super().request
+        return self.cache.get(self, url, lambda **kw: send(method, url, **kw), **kwargs)
+
+
+SESSIONS = {engine: PooledSession(timeout) for engine, timeout in ENGINE_TIMEOUTS.items()}
+
+
+class _PooledCrawler:
+    """Crawler mixin that adopts SESSIONS[engine] instead of a fresh session."""
+
+    engine: str
+
+    def set_session(self, headers=None):
+        self.session = SESSIONS[self.engine]
+
+
+class _BingCrawler(_PooledCrawler, BingImageCrawler):
+    engine = "Bing"
+
+
+class _BaiduCrawler(_PooledCrawler, BaiduImageCrawler):
+    engine = "Baidu"
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Engine runners
+# ─────────────────────────────────────────────────────────────────────────────
+
+def _search(crawler_cls, query: str, save_dir: str, headers: dict[str, str]) -> Future:
+    """Parse one query's result page and hand its image URLs to DOWNLOADS."""
+    urls: list[str] = []
+    crawler = crawler_cls(
+        downloader_cls=_URLCollector,
+        storage=era_storage(save_dir),
         parser_threads=1,
         downloader_threads=1,
+        extra_downloader_args={"sink": urls},
     )
-    _inject_headers(
-        crawler,
+    _inject_headers(crawler.session, headers)
+    crawler.crawl(keyword=query, max_num=IMAGES_PER_ENGINE * URL_OVERFETCH)
+    return DOWNLOADS.submit(urls, crawler.session, crawler.storage, IMAGES_PER_ENGINE)
+
+
+def crawl_bing(query: str, save_dir: str) -> Future:
+    """Queue IMAGES_PER_ENGINE images from Bing for a single query."""
+    return _search(_BingCrawler, query, save_dir, stealth_headers("https://www.bing.com/"))
+
+
+def crawl_baidu(query: str, save_dir: str) -> Future:
+    """Queue IMAGES_PER_ENGINE images from Baidu for a single query."""
+    return _search(
+        _BaiduCrawler, query, save_dir,
         stealth_headers("https://image.baidu.com/", lang="zh-CN,zh;q=0.9"),
     )
-    _extend_session_timeout(crawler, seconds=20)
-    crawler.crawl(
-        keyword=query,
-        max_num=IMAGES_PER_ENGINE,
-        file_idx_offset=file_idx_offset,
-    )
 
 
 # ─────────────────────────────────────────────────────────────────────────────
@@ -347,16 +1362,31 @@ def run_engine(
     fn,
     query: str,
     save_dir: str,
-    offset: int,
-) -> str:
+) -> tuple[str, Future | None]:
     """Execute one crawler engine for a single query with full error handling.
 
-    Returns one of: _OK | _SKIP_QUERY | _SKIP_ERA
+    Waits for the engine's EngineGate first (except offline, when nothing
+    reaches the engine) and returns as soon as the result page is parsed,
+    while the image downloads carry on in the background; the engine's turn
+    ends when they finish. Returns (token, downloads) where token is one of
+    _OK | _SKIP_QUERY | _SKIP_ERA and downloads is the download Future on _OK.
     """
     try:
-        fn(query, save_dir, offset)
+        cache = SESSIONS[engine_name].cache
+        if cache is not None and cache.offline:
+            gate = nullcontext(lambda downloads: None)
+        else:
+            gate = ENGINE_GATES[engine_name].slot()
+        with gate as hold_until:
+            downloads = fn(query, save_dir)
+            hold_until(downloads)
         logger.info("      [%s] OK — '%s'", engine_name, query)
-        return _OK
+        return _OK, downloads
+
+    except RunStopping:
+        # Left unchecked; process_era leaves the era before the next query.
+        logger.info("      [%s] Run stopping — not sending '%s'.", engine_name, query)
+        return _SKIP_QUERY, None
 
     except (ConnectionError, TimeoutError) as exc:
         if _is_blocked(exc):
@@ -369,7 +1399,7 @@ def run_engine(
                 "      [%s] Network/Timeout error on query '%s' — skipping query. (%s)",
                 engine_name, query, exc,
             )
-        return _SKIP_QUERY
+        return _SKIP_QUERY, None
 
     except Exception as exc:  # noqa: BLE001
         if _is_blocked(exc):
@@ -377,16 +1407,57 @@ def run_engine(
                 "      [%s] BLOCKED (403/429) on query '%s' — skipping entire era. (%s)",
                 engine_name, query, exc,
             )
-            return _SKIP_ERA
+            return _SKIP_ERA, None
         logger.error(
             "      [%s] Unexpected error on query '%s' — skipping query. (%s)",
             engine_name, query, exc,
         )
-        return _SKIP_QUERY
+        return _SKIP_QUERY, None
 
 
-def process_era(era: dict, base_dir: Path, checkpoint: Checkpoint) -> None:
-    """Download images for every query belonging to a single era."""
+# Queries whose search succeeded — (query, engines, downloads) — waiting on
+# their background downloads
+Pending = list[tuple[str, list[str], list[Future]]]
+
+
+def settle(
+    pending: Pending, checkpoint: CheckpointStore, era_key: str, wait: bool, drain: bool = False,
+) -> None:
+    """Checkpoint every pending query whose downloads have finished.
+
+    With *wait* set, block until all of them have — unless the run is
+    stopping, when unfinished ones are left for close() to cancel — and,
+    with *drain* too, until the era's inline stage is done. A query whose
+    download job crashed or was cancelled is left unmarked so the next run
+    retries it.
+    """
+    wait = wait and not _STOP.is_set()
+    for entry in list(pending):
+        query, engines, downloads = entry
+        if not wait and not all(f.done() for f in downloads):
+            continue
+        pending.remove(entry)
+        try:
+            stored = sum(len(f.result()) for f in downloads)
+        except Exception as exc:  # noqa: BLE001
+            logger.error("      Download stage failed for '%s' — will retry. (%s)", query, exc)
+            continue
+        logger.info("      Stored %d image(s) — '%s'", stored, query)
+        mark_done(checkpoint, era_key, query, engines, stored)
+        logger.info("      Checkpoint saved — '%s'", query)
+    if wait and drain:
+        DOWNLOADS.drain(era_key)
+
+
+def process_era(
+    era: dict, base_dir: Path, checkpoint: CheckpointStore, quota: int = ERA_IMAGE_QUOTA,
+) -> None:
+    """Download images for every query belonging to a single era.
+
+    With *quota* > 0 the era stops issuing queries as soon as it holds that
+    many valid, distinct images; the remaining queries stay unchecked so a
+    later run with a higher quota picks them up.
+    """
     title   = era.get("title", "unknown")
     queries = era.get("icrawler_queries", [])
     total   = len(queries)
@@ -410,50 +1481,64 @@ def process_era(era: dict, base_dir: Path, checkpoint: Checkpoint) -> None:
         title, total, "y" if total == 1 else "ies", already_done,
     )
     logger.info("    Save dir : %s", save_dir)
+    storage = open_era_storage(folder)
+    if quota > 0:
+        storage.quota = EraQuota(folder, quota)
+        logger.info("    Quota    : %d / %d valid, distinct images", storage.quota.count, quota)
 
-    for i, query in enumerate(queries, start=1):
-
-        # ── Skip already-completed queries ────────────────────────────────────
-        if is_done(checkpoint, era_key, query):
-            logger.info("  -- Query [%d/%d]: SKIP (checkpoint) '%s'", i, total, query)
-            continue
-
-        logger.info("  -- Query [%d/%d]: '%s'", i, total, query)
-
-        # ── Bing ──────────────────────────────────────────────────────────────
-        offset      = count_images(save_dir)
-        bing_result = run_engine("Bing", crawl_bing, query, save_dir, offset)
-
-        if bing_result == _SKIP_ERA:
-            logger.warning("    Hard block on Bing — aborting era '%s'.", title)
-            return
-
-        # ── Fixed engine-switch delay ──────────────────────────────────────────
-        logger.info(
-            "      Sleeping %ds (engine switch: Bing -> Baidu)...",
-            INTER_ENGINE_DELAY,
-        )
-        time.sleep(INTER_ENGINE_DELAY)
-
-        # ── Baidu ─────────────────────────────────────────────────────────────
-        offset       = count_images(save_dir)
-        baidu_result = run_engine("Baidu", crawl_baidu, query, save_dir, offset)
-
-        if baidu_result == _SKIP_ERA:
-            logger.warning("    Hard block on Baidu — aborting era '%s'.", title)
-            return
-
-        # ── Checkpoint: mark done if at least one engine fetched images ────────
-        # Queries where both engines failed are left unmarked for automatic retry.
-        if _OK in (bing_result, baidu_result):
-            mark_done(checkpoint, era_key, query)
-            logger.info("      Checkpoint saved — '%s'", query)
-
-        # ── Query-cycle jitter (omit after the final query) ───────────────────
-        if i < total:
-            jitter = random.uniform(JITTER_MIN, JITTER_MAX)
-            logger.info("      Jitter %.2fs before next query...", jitter)
-            time.sleep(jitter)
+    pending: Pending = []
+    try:
+        for i, query in enumerate(queries, start=1):
+            if _STOP.is_set():
+                logger.info("    Run stopping — leaving era '%s' at query %d/%d.", title, i, total)
+                return
+
+            # ── Skip already-completed queries ────────────────────────────────
+            if is_done(checkpoint, era_key, query):
+                logger.info("  -- Query [%d/%d]: SKIP (checkpoint) '%s'", i, total, query)
+                continue
+
+            # ── Quota: stop once enough images exist ──────────────────────────
+            # Wait for in-flight downloads only when they alone could meet it.
+            if storage.quota is not None:
+                in_flight = IMAGES_PER_ENGINE * sum(len(d) for _, _, d in pending)
+                if storage.quota.count + in_flight >= quota:
+                    settle(pending, checkpoint, era_key, wait=True)
+                if storage.quota.met:
+                    logger.info(
+                        "    Quota met (%d/%d) — skipping the remaining %d quer%s.",
+                        storage.quota.count, quota, total - i + 1,
+                        "y" if total - i + 1 == 1 else "ies",
+                    )
+                    break
+
+            logger.info("  -- Query [%d/%d]: '%s'", i, total, query)
+
+            # ── Bing ──────────────────────────────────────────────────────────
+            bing_result, bing_dl = run_engine("Bing", crawl_bing, query, save_dir)
+
+            if bing_result == _SKIP_ERA:
+                logger.warning("    Hard block on Bing — aborting era '%s'.", title)
+                return
+
+            # ── Baidu ─────────────────────────────────────────────────────────
+            baidu_result, baidu_dl = run_engine("Baidu", crawl_baidu, query, save_dir)
+
+            if baidu_result == _SKIP_ERA:
+                logger.warning("    Hard block on Baidu — aborting era '%s'.", title)
+                return
+
+            # ── Checkpoint once the downloads land, if at least one engine ────
+            # returned results. Queries where both engines failed are left
+            # unmarked for automatic retry.
+            if _OK in (bing_result, baidu_result):
+                engines = [name for name, result in (("Bing", bing_result), ("Baidu", baidu_result))
+                           if result == _OK]
+                downloads = [f for f in (bing_dl, baidu_dl) if f is not None]
+                pending.append((query, engines, downloads))
+            settle(pending, checkpoint, era_key, wait=False)
+    finally:
+        settle(pending, checkpoint, era_key, wait=True, drain=True)
 
     logger.info("    Era '%s' complete.", title)
 
@@ -462,7 +1547,16 @@ def process_era(era: dict, base_dir: Path, checkpoint: Checkpoint) -> None:
 # Entry point
 # ─────────────────────────────────────────────────────────────────────────────
 
-def main() -> None:
+def main(
+    process_inline: bool = PROCESS_INLINE,
+    process_workers: int = PROCESS_WORKERS,
+    quota: int = ERA_IMAGE_QUOTA,
+    http_cache: bool = False,
+    offline: bool = False,
+    cache_ttl: float = HTTP_CACHE_TTL,
+) -> None:
+    _configure_logging()
+
     research_path = Path(RESEARCH_FILE)
     if not research_path.exists():
         logger.error(
@@ -487,14 +1581,14 @@ def main() -> None:
     base_dir = Path(ASSETS_DIR)
     base_dir.mkdir(exist_ok=True)
 
-    checkpoint   = load_checkpoint()
-    total_done   = sum(len(v) for v in checkpoint.values())
+    checkpoint   = open_checkpoint()
+    total_done   = checkpoint.total_done()
     total_queries = sum(len(e.get("icrawler_queries", [])) for e in eras)
 
     logger.info("Fashion Image Crawler — starting.  Eras: %d", len(eras))
     logger.info("Output root  : %s", base_dir.resolve())
     logger.info("Status log   : %s", Path(LOG_FILE).resolve())
-    logger.info("Checkpoint   : %s", Path(CHECKPOINT_FILE).resolve())
+    logger.info("Checkpoint   : %s", Path(CHECKPOINT_PATHS[CHECKPOINT_BACKEND]).resolve())
     if total_done:
         logger.info(
             "Resuming     : %d / %d quer%s already complete — will skip those.",
@@ -504,13 +1598,140 @@ def main() -> None:
     else:
         logger.info("Checkpoint   : empty — fresh run.")
 
-    for era in eras:
-        process_era(era, base_dir, checkpoint)
+    logger.info("Era workers  : %d", ERA_WORKERS)
+    if quota > 0:
+        logger.info("Era quota    : %d valid, distinct images per era", quota)
+
+    cache = None
+    if http_cache or offline:
+        cache = HTTPReplayCache(Path(HTTP_CACHE_DIR), ttl=cache_ttl, offline=offline)
+        for session in SESSIONS.values():
+            session.cache = cache
+        logger.info("HTTP cache   : %s (%s)", Path(HTTP_CACHE_DIR).resolve(),
+                    "offline" if offline else f"TTL {cache_ttl:g}s")
+
+    if process_inline:
+        if base_dir.resolve() != convert_webp.ASSETS_DIR.resolve():
+            logger.error(
+                "Inline processing needs '%s' to be convert_webp's %s — disabled.",
+                ASSETS_DIR, convert_webp.ASSETS_DIR,
+            )
+        else:
+            DOWNLOADS.processor = InlineProcessor(process_workers)
+            logger.info("Inline stage : %d worker process(es)", process_workers)
+
+    _STOP.clear()
+    # The download loop must outlive every era worker: a worker that is
+    # still running settles its queries by waiting on their download Futures.
+    try:
+        with ThreadPoolExecutor(max_workers=ERA_WORKERS, thread_name_prefix="era") as pool:
+            futures = [pool.submit(process_era, era, base_dir, checkpoint, quota) for era in eras]
+            try:
+                for future in futures:
+                    future.result()
+            except BaseException:
+                # Leaving the with block waits for the running eras, so make
+                # them stop at their next query rather than finish
+                _STOP.set()
+                pool.shutdown(wait=False, cancel_futures=True)
+                raise
+    finally:
+        DOWNLOADS.close()
+        if DOWNLOADS.processor is not None:
+            DOWNLOADS.processor.close()
+        for session in SESSIONS.values():
+            session.close()
+        checkpoint.close()
+        if cache is not None:
+            logger.info("HTTP cache   : %d hit(s), %d revalidated, %d fetched",
+                        cache.hits, cache.revalidated, cache.misses)
+        for gate in ENGINE_GATES.values():
+            logger.info("Engine %-6s: %d quer%s, %.1fs searching, %.1fs politeness wait",
+                        gate.name, gate.queries, "y" if gate.queries == 1 else "ies",
+                        gate.searching, gate.waited)
 
     logger.info(
         "All eras processed. Review '%s' for any blocked / error events.", LOG_FILE
     )
 
 
+def import_checkpoint() -> None:
+    """Merge completed_queries.json into the CHECKPOINT_BACKEND store."""
+    _configure_logging()
+    if CHECKPOINT_BACKEND == "json":
+        logger.info("CHECKPOINT_BACKEND is 'json' — nothing to import.")
+        return
+    store = _open_store()
+    imported = store.import_json(load_checkpoint())
+    logger.info("Imported %d new quer%s from %s into %s (%d total).",
+                imported, "y" if imported == 1 else "ies",
+                CHECKPOINT_FILE, CHECKPOINT_PATHS[CHECKPOINT_BACKEND], store.total_done())
+    store.close()
+
+
+def export_checkpoint() -> None:
+    """Rewrite completed_queries.json from the CHECKPOINT_BACKEND store."""
+    _configure_logging()
+    if CHECKPOINT_BACKEND == "json":
+        logger.info("CHECKPOINT_BACKEND is 'json' — nothing to export.")
+        return
+    store = _open_store()
+    save_checkpoint(store.export())
+    logger.info("Exported %d quer%s from %s to %s.",
+                store.total_done(), "y" if store.total_done() == 1 else "ies",
+                CHECKPOINT_PATHS[CHECKPOINT_BACKEND], CHECKPOINT_FILE)
+    store.close()
+
+
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(
+        description="Automates image collection for the Skirts History research project.",
+    )
+    group = parser.add_mutually_exclusive_group()
+    group.add_argument(
+        "--import-checkpoint", action="store_true",
+        help=f"merge {CHECKPOINT_FILE} into the {CHECKPOINT_BACKEND} checkpoint and exit",
+    )
+    group.add_argument(
+        "--export-checkpoint", action="store_true",
+        help=f"write the {CHECKPOINT_BACKEND} checkpoint out as {CHECKPOINT_FILE} and exit",
+    )
+    parser.add_argument(
+        "--process", action="store_true", default=PROCESS_INLINE,
+        help="score and convert each download in memory, updating "
+             "convert_manifest.json and audit_cache.sqlite3",
+    )
+    parser.add_argument(
+        "--process-workers", type=int, default=PROCESS_WORKERS,
+        help=f"processes for --process (default: CPU count, {PROCESS_WORKERS})",
+    )
+    parser.add_argument(
+        "--quota", type=int, default=ERA_IMAGE_QUOTA, metavar="N",
+        help="stop each era once it holds N valid, distinct images (0 = off)",
+    )
+    parser.add_argument(
+        "--http-cache", action="store_true",
+        help=f"serve repeat GETs from {HTTP_CACHE_DIR}/ (ETag/Last-Modified aware)",
+    )
+    parser.add_argument(
+        "--cache-ttl", type=float, default=HTTP_CACHE_TTL, metavar="SECONDS",
+        help=f"age after which cached responses are revalidated (default: {HTTP_CACHE_TTL})",
+    )
+    parser.add_argument(
+        "--offline", action="store_true",
+        help=f"serve only from {HTTP_CACHE_DIR}/ and never touch the network",
+    )
+    args = parser.parse_args()
+    if args.import_checkpoint:
+        import_checkpoint()
+    elif args.export_checkpoint:
+        export_checkpoint()
+    else:
+        main(
+            process_inline=args.process,
+            process_workers=max(1, args.process_workers),
+            quota=max(0, args.quota),
+            http_cache=args.http_cache,
+            offline=args.offline,
+            cache_ttl=args.cache_ttl,
+        )
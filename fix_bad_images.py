@@ -10,11 +10,52 @@ Swaps performed (all positions are 1-indexed):
   Era 09 (1940s/New Look):     pos 1,2,3 are
                                 era-06 duplicates → overwrite with pos 4,5,4
   Era 12 (21st Century):       pos 2 tiny/flat → overwrite with pos 3
+
+Swaps are zero-copy where the filesystem allows: each full image (plus its
+srcset ladder and AVIF siblings) is reflinked, else hardlinked, else
+copied into place via a temp-file rename. The source position's thumbnail
+is reused the same way when it still matches the current THUMB_MAX /
+THUMB_QUALITY; only stale or missing thumbnails are re-encoded.
+
+Every run is transactional per era: the final state of each position is
+resolved from the whole swap list first (so chains like era 09's 1←4, 3←4
+read the original 4), all new files are staged in <era>/.fix-stage/, and
+a journal (<era>/.fix-journal.json) is written before anything is renamed
+into place. Eras are applied in parallel. If a run dies mid-commit, the
+next run rolls the journal back before doing anything else. The promoted
+image's original moves with it, to <position>.<ext>, so a later
+convert_webp run (even with --force) re-renders the promoted picture
+rather than the one it replaced. Afterwards each promoted position's
+convert_manifest.json entry and src/data/renditions.json entry are
+rewritten to describe the files now in place (source stat and hash,
+widths, bytes, which ladder rungs exist).
+
+With --auto the SWAPS table is ignored: every candidate image in each era
+folder is audited (via audit_images, cache included), flagged images are
+discarded, the rest are scored and picked greedily while skipping
+near-duplicates of anything already picked in this or an earlier era, and
+the top IMAGES_PER_ERA are promoted into positions 000001–000005. Picks
+already in place are left untouched, picks that are existing WebP
+renditions are linked like a swap, and only originals are re-rendered
+(full, thumb and srcset ladder) in one batched process-pool pass, so a
+repeat --auto run is a no-op.
+
+Usage:
+    python fix_bad_images.py                      # apply SWAPS
+    python fix_bad_images.py --auto               # re-curate every era
+    python fix_bad_images.py --auto --dry-run 06_victorian_era_crinolines
 """
+import argparse
+import json
+import os
 import shutil
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from pathlib import Path
 from PIL import Image
 
+import audit_images
+import convert_webp
+
 ASSETS = Path(__file__).parent / "assets"
 THUMB_MAX = 380
 THUMB_QUALITY = 75
@@ -31,6 +72,18 @@ SWAPS = [
     ("12_21st_century_and_gender_neutrality",     2, 3),
 ]
 
+# --auto scoring. Each term is normalised to roughly 0–1 at a "good" value.
+SCORE_WEIGHTS = {
+    "entropy": 1.0,    # / 8 bits
+    "edges":   1.0,    # / 0.15
+    "std":     1.0,    # / 60
+    "colour":  0.5,    # / 60
+}
+ORIGINAL_BONUS = 0.05  # prefer a crawled original over a re-encoded WebP
+
+STAGE_DIR = ".fix-stage"            # per-era staging area (same filesystem)
+JOURNAL_FILE = ".fix-journal.json"  # per-era rollback journal
+
 
 def stem(n: int) -> str:
     return f"{n:06d}"
@@ -41,26 +94,614 @@ def regen_thumb(full_path: Path, thumb_path: Path) -> None:
     with Image.open(full_path) as img:
         img = img.convert("RGB")
         img.thumbnail((THUMB_MAX, THUMB_MAX * 2), Image.LANCZOS)
-        img.save(thumb_path, "WEBP", quality=THUMB_QUALITY, method=6)
+        convert_webp.save_atomic(
+            thumb_path,
+            lambda fh: img.save(fh, "WEBP", quality=THUMB_QUALITY, method=6),
+        )
+
+
+FICLONE = 0x40049409   # linux/fs.h — share extents copy-on-write
+
+
+def link_or_copy(src: Path, dest: Path) -> str:
+    """Place *src*'s bytes at *dest* as cheaply as possible.
+
+    Tries a reflink, then a hardlink, then a real copy — always into a temp
+    name that is renamed over *dest*, so whatever inode *dest* had before
+    (possibly shared with another position) is never written to.
+    Returns which method was used.
+    """
+    tmp = dest.with_name(f".{dest.name}.tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        try:
+            import fcntl    # POSIX only — on Windows fall through to a hardlink
+            with src.open("rb") as s, tmp.open("wb") as d:
+                fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+            method = "reflink"
+        except (ImportError, OSError):
+            tmp.unlink(missing_ok=True)
+            try:
+                os.link(src, tmp)
+                method = "hardlink"
+            except OSError:
+                shutil.copy2(src, tmp)
+                method = "copy"
+        tmp.replace(dest)
+    finally:
+        tmp.unlink(missing_ok=True)
+    return method
+
+
+def thumb_is_current(full_path: Path, thumb_path: Path) -> bool:
+    """True if *thumb_path* is a THUMB_MAX/THUMB_QUALITY thumbnail of *full_path*.
+
+    Only image headers are read. The thumb must be at least as new as the
+    full image and have the dimensions regen_thumb() would produce (±1 px);
+    where convert_webp's manifest recorded the thumb, its quality must
+    match too.
+    """
+    if not thumb_path.exists():
+        return False
+    if thumb_path.stat().st_mtime_ns < full_path.stat().st_mtime_ns:
+        return False
+    with Image.open(full_path) as full, Image.open(thumb_path) as thumb:
+        expected = Image.new("L", full.size)
+        expected.thumbnail((THUMB_MAX, THUMB_MAX * 2))
+        # render() derives the thumb from a ladder rung, not the full
+        # image, so rounding can leave it a pixel off regen_thumb()'s size
+        if any(abs(a - b) > 1 for a, b in zip(thumb.size, expected.size)):
+            return False
+    rel = str(thumb_path.relative_to(ASSETS))
+    for entry in _manifest().values():
+        for out in entry.get("outputs", []):
+            if out["path"] == rel:
+                return out.get("quality", THUMB_QUALITY) == THUMB_QUALITY
+    return True
+
+
+_manifest_cache: dict | None = None
+
+
+def _manifest() -> dict:
+    global _manifest_cache
+    if _manifest_cache is None:
+        _manifest_cache = convert_webp.load_manifest()
+    return _manifest_cache
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Transactions — stage, journal, rename into place, roll back on failure
+# ─────────────────────────────────────────────────────────────────────────────
+
+def is_position(p: Path) -> bool:
+    return p.stem.isdigit() and 1 <= int(p.stem) <= convert_webp.IMAGES_PER_ERA
+
+
+def originals(era_dir: Path, n: int) -> list[Path]:
+    """Non-WebP images stored under position *n*'s stem, the one
+    convert_webp renders from (if any) first."""
+    source = convert_webp.find_source(era_dir, n)
+    found = sorted(
+        p for p in era_dir.glob(f"{stem(n)}.*")
+        if p.suffix.lower() in audit_images.IMAGE_EXTENSIONS - {".webp"}
+    )
+    return sorted(found, key=lambda p: p != source)
+
+
+def rendition_files(n: int) -> list[str]:
+    """Every path, relative to the era dir, that can hold position *n*'s image."""
+    return [
+        f"{subdir}/{stem(n)}{ext}".lstrip("/")
+        for subdir in ["", "thumbs", *sorted(convert_webp.LADDER_DIRS)]
+        for ext in (".webp", ".avif")
+    ]
+
+
+def resolve_swaps(swaps=SWAPS) -> dict[str, dict[int, int]]:
+    """Collapse the ordered swap list into {era: {dest_pos: original_pos}}.
+
+    SWAPS is applied top to bottom, so a later swap reads what an earlier
+    one wrote; tracking where each position's content originally came from
+    lets every swap in an era be staged from the untouched folder at once.
+    """
+    state: dict[str, dict[int, int]] = {}
+    for era_name, dest_n, src_n in swaps:
+        era = state.setdefault(era_name, {})
+        era[dest_n] = era.get(src_n, src_n)
+    return {
+        era_name: {d: s for d, s in era.items() if d != s}
+        for era_name, era in state.items()
+    }
+
+
+def rollback(era_dir: Path) -> bool:
+    """Undo an interrupted commit in *era_dir* and clear its staging area.
+
+    Returns True if a journal was found (i.e. something was rolled back).
+    """
+    journal = era_dir / JOURNAL_FILE
+    stage = era_dir / STAGE_DIR
+    found = journal.exists()
+    if found:
+        ops = json.loads(journal.read_text(encoding="utf-8"))
+        backup = stage / ".backup"
+        for op in reversed(ops):
+            dest = era_dir / op["rel"]
+            saved = backup / op["rel"]
+            if saved.exists():
+                saved.replace(dest)
+            elif not op["existed"]:
+                dest.unlink(missing_ok=True)
+        journal.unlink()
+    if stage.exists():
+        shutil.rmtree(stage)
+    return found
+
+
+def commit(era_dir: Path, positions: list[int], extra: list[str] = ()) -> None:
+    """Move everything staged for *positions*, plus the *extra* paths
+    (relative to *era_dir*), into place, all or nothing.
+
+    Files the stage has no counterpart for (e.g. a ladder width the new
+    image is too narrow for) are removed. The journal is fsynced before the
+    first rename; the originals are kept under .fix-stage/.backup until the
+    journal is deleted.
+    """
+    stage = era_dir / STAGE_DIR
+    backup = stage / ".backup"
+    ops = []
+    for rel in [rel for n in positions for rel in rendition_files(n)] + list(extra):
+        staged, dest = (stage / rel).exists(), (era_dir / rel).exists()
+        if staged or dest:
+            ops.append({"rel": rel, "staged": staged, "existed": dest})
+
+    journal = era_dir / JOURNAL_FILE
+    with journal.open("w", encoding="utf-8") as fh:
+        json.dump(ops, fh)
+        fh.flush()
+        os.fsync(fh.fileno())
+
+    try:
+        for op in ops:
+            dest = era_dir / op["rel"]
+            if op["existed"]:
+                (backup / op["rel"]).parent.mkdir(parents=True, exist_ok=True)
+                dest.rename(backup / op["rel"])
+            if op["staged"]:
+                dest.parent.mkdir(parents=True, exist_ok=True)
+                (stage / op["rel"]).rename(dest)
+    except BaseException:
+        rollback(era_dir)
+        raise
+    journal.unlink()
+    shutil.rmtree(stage)
+
+
+def stage_sources(era_dir: Path, sources: dict[int, Path | None]) -> list[str]:
+    """Stage each changed position's original under the position's stem.
+
+    *sources* maps a position to the original its new renditions come from
+    (None if it has none, e.g. a crawled WebP). Linking that file in as
+    <position><ext> makes convert_webp render the position from it, not
+    from the image it replaced. A picked candidate gives up its old name;
+    originals it displaces are staged under those freed names, or past the
+    highest index, so they stay candidates. Returns the paths, relative to
+    *era_dir*, for commit().
+    """
+    stage = era_dir / STAGE_DIR
+    placed = {f"{stem(n)}{src.suffix}": src for n, src in sources.items() if src is not None}
+    old = {p for n in sources for p in originals(era_dir, n)}
+    moved = {src for src in sources.values() if src is not None and not is_position(src)}
+    free = sorted(src.stem for src in moved)
+    last = max([0] + [int(p.stem) for p in era_dir.iterdir() if p.stem.isdigit()])
+    for p in sorted(old - set(sources.values())):
+        if free:
+            name = free.pop(0)
+        else:
+            last += 1
+            name = stem(last)
+        placed[f"{name}{p.suffix}"] = p
+    for rel, src in placed.items():
+        link_or_copy(src, stage / rel)
+    return sorted(set(placed) | {p.name for p in old | moved})
+
+
+def recover(era_dirs: list[Path]) -> None:
+    for era_dir in era_dirs:
+        if rollback(era_dir):
+            print(f"  ROLLED BACK  {era_dir.name}: interrupted run restored")
+
+
+def _subdir(rel: str) -> str:
+    """Rendition subdir of a manifest output path ("" for the full image)."""
+    parts = Path(rel).parts
+    return parts[1] if len(parts) == 3 else ""
+
+
+DEFAULT_QUALITIES = {subdir: quality for subdir, _, quality in convert_webp.RENDITIONS}
+
+
+def describe(era_dir: Path, n: int, qualities: dict[str, int]) -> list[dict]:
+    """Output records, in render()'s format, for the files now at position *n*.
+
+    *qualities* maps a rendition subdir to the quality it was encoded at,
+    where known; the rest come from convert_webp.RENDITIONS.
+    """
+    outputs = []
+    for subdir in ["", "thumbs", *sorted(convert_webp.LADDER_DIRS)]:
+        path = era_dir / subdir / f"{stem(n)}.webp"
+        if not path.exists():
+            continue
+        with Image.open(path) as img:
+            width, height = img.size
+        avif = path.with_suffix(".avif")
+        outputs.append({
+            "path": str(path.relative_to(ASSETS)),
+            "width": width,
+            "height": height,
+            "quality": qualities.get(subdir, DEFAULT_QUALITIES.get(subdir)),
+            "bytes": path.stat().st_size,
+            "avif_bytes": avif.stat().st_size if avif.exists() else None,
+        })
+    return outputs
+
+
+def record_promotions(moves: dict[Path, dict[int, int | None]]) -> None:
+    """Bring convert_manifest.json and renditions.json in line with *moves*.
+
+    *moves* maps each era to {dest_pos: source_pos}, or None for a pick
+    rendered afresh. Each position's old manifest entries are dropped and
+    one is written for the original stage_sources() put there, with that
+    file's real stat fields and hash, so convert_webp (even with --force)
+    renders the position from the promoted image. A moved position whose
+    source had no entry gets none. The position's renditions.json entry
+    follows, or is dropped if no full image is left.
+    """
+    manifest = _manifest()
+    srcset = convert_webp.load_srcset()
+    keys = {(Path(k).parent.name, Path(k).stem): k for k in manifest}
+    rendered = convert_webp.encoder_settings()
+
+    # Describe every position before touching any entry: a source's
+    # qualities and settings must be read from its entry as it was before
+    updates = []
+    for era_dir, mapping in moves.items():
+        for dest_n, src_n in mapping.items():
+            src_entry = manifest.get(keys.get((era_dir.name, stem(src_n)))) if src_n else None
+            qualities = {
+                _subdir(out["path"]): out["quality"]
+                for out in (src_entry or {}).get("outputs", []) if "quality" in out
+            }
+            settings = src_entry["settings"] if src_entry else None if src_n else rendered
+            updates.append((era_dir, dest_n, describe(era_dir, dest_n, qualities), settings))
+
+    for era_dir, n, outputs, settings in updates:
+        for key in [k for k in manifest
+                    if Path(k).parent.name == era_dir.name and Path(k).stem == stem(n)]:
+            del manifest[key]
+        source = next(iter(originals(era_dir, n)), None)
+        recorded = source is not None and settings is not None
+        if recorded:
+            st = source.stat()
+            manifest[str(source.relative_to(ASSETS))] = {
+                "size": st.st_size,
+                "mtime_ns": st.st_mtime_ns,
+                "sha256": convert_webp.file_sha256(source),
+                "settings": settings,
+                "outputs": outputs,
+            }
+        name = f"{era_dir.name}/{stem(n)}"
+        if recorded or name in srcset:
+            outs = convert_webp.srcset_outputs(outputs)
+            if any(len(Path(out["path"]).parts) == 2 for out in outputs):
+                srcset[name] = outs
+            else:
+                srcset.pop(name, None)
+    if updates:
+        convert_webp.save_manifest(manifest)
+        convert_webp.write_srcset(srcset)
+
+
+def stage_swaps(era_dir: Path, mapping: dict[int, int]) -> tuple[list[int], list[str]]:
+    """Stage position *dest* ← original position *src* for every mapping entry.
+
+    Full images, srcset ladder and AVIF siblings are linked zero-copy from
+    the (still untouched) era folder; the thumb is linked when current,
+    otherwise re-encoded into the stage. Returns (staged_positions, lines).
+    """
+    stage = era_dir / STAGE_DIR
+    positions, lines = [], []
+    for dest_n, src_n in sorted(mapping.items()):
+        src_full = era_dir / f"{stem(src_n)}.webp"
+        if not src_full.exists():
+            lines.append(f"  SKIP  {era_dir.name}: source {src_full.name} missing")
+            continue
+
+        for subdir in ["", *sorted(convert_webp.LADDER_DIRS)]:
+            for ext in (".webp", ".avif"):
+                src = era_dir / subdir / f"{stem(src_n)}{ext}"
+                if src.exists():
+                    staged = stage / subdir / f"{stem(dest_n)}{ext}"
+                    staged.parent.mkdir(parents=True, exist_ok=True)
+                    link_or_copy(src, staged)
+
+        src_thumb = era_dir / "thumbs" / f"{stem(src_n)}.webp"
+        staged_thumb = stage / "thumbs" / f"{stem(dest_n)}.webp"
+        staged_thumb.parent.mkdir(parents=True, exist_ok=True)
+        if thumb_is_current(src_full, src_thumb):
+            note = f"thumb {link_or_copy(src_thumb, staged_thumb)}"
+            if src_thumb.with_suffix(".avif").exists():
+                link_or_copy(src_thumb.with_suffix(".avif"), staged_thumb.with_suffix(".avif"))
+        else:
+            regen_thumb(src_full, staged_thumb)
+            note = "thumb re-encoded"
+
+        positions.append(dest_n)
+        src_kb = src_full.stat().st_size // 1024
+        lines.append(
+            f"  FIXED  {era_dir.name}/{stem(dest_n)}.webp  ← {stem(src_n)}.webp  ({src_kb}KB, {note})"
+        )
+    return positions, lines
+
+
+def _fix_era(era_dir: Path, mapping: dict[int, int]) -> tuple[list[int], list[str]]:
+    positions, lines = stage_swaps(era_dir, mapping)
+    sources = {n: next(iter(originals(era_dir, mapping[n])), None) for n in positions}
+    commit(era_dir, positions, stage_sources(era_dir, sources))
+    return positions, lines
+
+
+def apply_swaps(swaps=SWAPS, workers: int = convert_webp.WORKERS) -> None:
+    plan = resolve_swaps(swaps)
+    era_dirs = [ASSETS / era_name for era_name in plan]
+    recover(era_dirs)
+    moves: dict[Path, dict[int, int | None]] = {}
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for era_dir, mapping, (positions, lines) in zip(
+            era_dirs, plan.values(), pool.map(_fix_era, era_dirs, plan.values()),
+        ):
+            moves[era_dir] = {n: mapping[n] for n in positions}
+            for line in lines:
+                print(line)
+    record_promotions(moves)
+
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Automatic selection (--auto)
+# ─────────────────────────────────────────────────────────────────────────────
+
+def score(result: dict) -> float:
+    """Higher is better; 0 for anything the audit flagged."""
+    if result["flags"]:
+        return 0.0
+    total = (
+        SCORE_WEIGHTS["entropy"] * min(result["entropy"] / 8, 1)
+        + SCORE_WEIGHTS["edges"] * min(result["edges"] / 0.15, 1)
+        + SCORE_WEIGHTS["std"] * min(result["std"] / 60, 1)
+        + SCORE_WEIGHTS["colour"] * min(result["colour"] / 60, 1)
+    )
+    if not result["file"].endswith(".webp"):
+        total += ORIGINAL_BONUS
+    return total
+
+
+def audit_candidates(paths: list[Path], workers: int) -> dict[Path, dict]:
+    """Audit results for *paths*, served from audit_images' cache where possible.
+
+    A file that cannot be audited (corrupt or unsupported crawl output) is
+    reported and left out, so it is never picked.
+    """
+    cache = audit_images.AuditCache()
+    results: dict[Path, dict] = {}
+    todo = []
+    for p in paths:
+        hit = cache.get(p)
+        if hit is not None:
+            results[p] = hit
+        else:
+            todo.append(p)
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(audit_images._audit_task, p): p for p in todo}
+            for future, p in futures.items():
+                try:
+                    result, sha256 = future.result()
+                except Exception as e:  # noqa: BLE001 — corrupt/unsupported crawl output
+                    print(f"  SKIP   {p.relative_to(ASSETS)}: unreadable ({e})")
+                    continue
+                cache.put(p, sha256, result)
+                results[p] = result
+    finally:
+        cache.close()
+    return results
+
+
+def rendered_original(era_dir: Path, n: int, manifest: dict) -> Path | None:
+    """Position *n*'s original, if its WebP is still the render recorded for it.
+
+    That is, the original's manifest entry lists the WebP at its current
+    size, and the original is unchanged (size and mtime, else content hash).
+    """
+    webp = era_dir / f"{stem(n)}.webp"
+    if not webp.exists():
+        return None
+    rel = str(webp.relative_to(ASSETS))
+    for src in originals(era_dir, n):
+        entry = manifest.get(str(src.relative_to(ASSETS)))
+        if not entry or not any(
+            out["path"] == rel and out["bytes"] == webp.stat().st_size
+            for out in entry.get("outputs", [])
+        ):
+            continue
+        st = src.stat()
+        if entry.get("size") == st.st_size and (
+            entry.get("mtime_ns") == st.st_mtime_ns
+            or entry.get("sha256") == convert_webp.file_sha256(src)
+        ):
+            return src
+    return None
+
+
+def select(era_dirs: list[Path], workers: int) -> dict[Path, list[tuple[Path, float]]]:
+    """Pick up to IMAGES_PER_ERA distinct images per era, best first.
+
+    Eras are walked in order and share one dHash index, so an image that
+    duplicates an earlier era's pick is never picked again. A position's
+    WebP that is a current render of its original is ranked by the
+    original's score and stands in for it. A promoted pick therefore
+    ranks the same on the next run, whatever its re-encode scores.
+    """
+    candidates = {
+        era_dir: [
+            p for p in sorted(era_dir.iterdir())
+            if p.is_file() and p.suffix.lower() in audit_images.IMAGE_EXTENSIONS
+        ]
+        for era_dir in era_dirs
+    }
+    results = audit_candidates([p for ps in candidates.values() for p in ps], workers)
+    manifest = convert_webp.load_manifest()
+    for era_dir in era_dirs:
+        for n in range(1, convert_webp.IMAGES_PER_ERA + 1):
+            src = rendered_original(era_dir, n, manifest)
+            webp = era_dir / f"{stem(n)}.webp"
+            if src in results and webp in results:
+                results[webp] = results.pop(src)
+
+    picked_index = audit_images.BKTree()
+    picks: dict[Path, list[tuple[Path, float]]] = {}
+    for era_dir in era_dirs:
+        ranked = sorted(
+            ((score(results[p]), p) for p in candidates[era_dir] if p in results),
+            key=lambda sp: (-sp[0], sp[1].name),
+        )
+        era_picks: list[tuple[Path, float]] = []
+        for s, p in ranked:
+            if s <= 0 or len(era_picks) == convert_webp.IMAGES_PER_ERA:
+                break
+            h = int(results[p]["dhash"], 16)
+            if picked_index.search(h, audit_images.DUP_DISTANCE):
+                continue
+            picked_index.add(h, p)
+            era_picks.append((p, s))
+        picks[era_dir] = era_picks
+    return picks
+
+
+def _render_task(task: tuple[Path, Path, str]) -> list[str]:
+    src, stage, dest_stem = task
+    lines, _ = convert_webp.render(src, stage, dest_stem)
+    return lines
+
+
+def in_place(src: Path, era_dir: Path, n: int, manifest: dict, settings: list[list]) -> bool:
+    """True if position *n* already holds *src*'s renditions.
+
+    That is *src* being position *n*'s own WebP, or position *n*'s original
+    whose convert_webp manifest entry is still fresh.
+    """
+    if src.parent != era_dir or src.stem != stem(n):
+        return False
+    if src.suffix.lower() == ".webp":
+        return True
+    entry = manifest.get(str(src.relative_to(convert_webp.ASSETS_DIR)))
+    return convert_webp.is_fresh(entry, src, settings)
+
+
+def promote(picks: dict[Path, list[tuple[Path, float]]], workers: int) -> None:
+    """Stage every pick into its era, then commit the eras in parallel.
+
+    Picks already at their position are left alone. A pick that is another
+    position's WebP is linked with its ladder and thumb, as stage_swaps()
+    does for SWAPS, rather than re-encoded; only originals are rendered,
+    in one process-pool pass. Either way the pick's original becomes the
+    position's source (stage_sources()). Nothing in an era folder changes
+    until its commit, so picks are read straight from their current
+    positions.
+    """
+    manifest = convert_webp.load_manifest()
+    settings = convert_webp.encoder_settings()
+    tasks: list[tuple[Path, Path, str]] = []
+    links: dict[Path, dict[int, int]] = {}
+    sources: dict[Path, dict[int, Path | None]] = {}
+    changed: dict[Path, list[int]] = {}
+    kept: list[str] = []
+    for era_dir, era_picks in picks.items():
+        for n, (src, _) in enumerate(era_picks, start=1):
+            if in_place(src, era_dir, n, manifest, settings):
+                kept.append(f"  KEPT   {era_dir.name}/{stem(n)}.webp  ← {src.name}")
+                continue
+            changed.setdefault(era_dir, []).append(n)
+            if src.suffix.lower() == ".webp" and src.parent == era_dir and src.stem.isdigit():
+                links.setdefault(era_dir, {})[n] = int(src.stem)
+                source = next(iter(originals(era_dir, int(src.stem))), None)
+            else:
+                tasks.append((src, era_dir / STAGE_DIR, stem(n)))
+                source = src if src.suffix.lower() != ".webp" else None
+            sources.setdefault(era_dir, {})[n] = source
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(_render_task, tasks))
+
+    def _commit(era_dir: Path) -> list[str]:
+        _, lines = stage_swaps(era_dir, links.get(era_dir, {}))
+        commit(era_dir, changed[era_dir], stage_sources(era_dir, sources[era_dir]))
+        return lines
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        linked = [line for lines in pool.map(_commit, changed) for line in lines]
+    record_promotions({
+        era_dir: {n: links.get(era_dir, {}).get(n) for n in positions}
+        for era_dir, positions in changed.items()
+    })
+    for line in kept:
+        print(line)
+    for src, stage, dest_stem in tasks:
+        print(f"  FIXED  {stage.parent.name}/{dest_stem}.webp  ← {src.name}")
+    for line in linked:
+        print(line)
+
 
+def auto_fix(era_names: list[str], workers: int, dry_run: bool) -> None:
+    era_dirs = sorted(
+        d for d in ASSETS.iterdir()
+        if d.is_dir() and (not era_names or d.name in era_names)
+    )
+    recover(era_dirs)
+    picks = select(era_dirs, workers)
 
-for era_name, dest_n, src_n in SWAPS:
-    era_dir = ASSETS / era_name
-    src_full  = era_dir / f"{stem(src_n)}.webp"
-    dest_full = era_dir / f"{stem(dest_n)}.webp"
-    dest_thumb = era_dir / "thumbs" / f"{stem(dest_n)}.webp"
+    for era_dir, era_picks in picks.items():
+        print(f"\n[{era_dir.name}]")
+        for n in range(1, convert_webp.IMAGES_PER_ERA + 1):
+            if n <= len(era_picks):
+                src, s = era_picks[n - 1]
+                print(f"  {stem(n)}  ← {src.name}  (score {s:.2f})")
+            else:
+                print(f"  {stem(n)}  — no acceptable candidate, left as is")
 
-    if not src_full.exists():
-        print(f"  SKIP  {era_name}: source {src_full.name} missing")
-        continue
+    if dry_run:
+        print("\nDry run — nothing written.")
+        return
+    print()
+    promote(picks, workers)
 
-    # Copy full WebP
-    shutil.copy2(src_full, dest_full)
-    # Regenerate thumbnail from the full WebP
-    regen_thumb(dest_full, dest_thumb)
 
-    src_kb  = src_full.stat().st_size // 1024
-    dest_kb = dest_full.stat().st_size // 1024
-    print(f"  FIXED  {era_name}/{stem(dest_n)}.webp  ← {stem(src_n)}.webp  ({src_kb}KB)")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--auto", action="store_true",
+        help="score every candidate and promote the best, ignoring SWAPS",
+    )
+    parser.add_argument("--dry-run", action="store_true", help="--auto: print the plan only")
+    parser.add_argument(
+        "--workers", type=int, default=convert_webp.WORKERS,
+        help=f"worker processes / parallel eras (default: CPU count, {convert_webp.WORKERS})",
+    )
+    parser.add_argument("eras", nargs="*", help="--auto: limit to these era folders")
+    args = parser.parse_args()
 
-print("\nDone.")
+    if args.auto:
+        auto_fix(args.eras, max(1, args.workers), args.dry_run)
+    else:
+        apply_swaps(workers=max(1, args.workers))
+    print("\nDone.")
@@ -0,0 +1,38 @@
+"""
+Image helpers shared by fashion_crawler.py and audit_images.py.
+
+Kept free of imports from either script, so both can import it at module
+level without importing each other.
+"""
+from pathlib import Path
+from typing import BinaryIO
+
+import numpy as np
+from PIL import Image
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".webp"}
+
+# Pillow reports a JPEG carrying an MPF block (phones, cameras) as MPO
+JPEG_FORMATS = {"jpeg", "mpo"}
+
+AUDIT_SIZE = 256         # px — longest edge the audit metrics are computed at
+
+
+def load_reduced(path: Path | BinaryIO, size: int = AUDIT_SIZE) -> np.ndarray:
+    """Decode *path* (or an in-memory file) at roughly *size* px on the long
+    edge, as float32 RGB.
+
+    thumbnail() asks the decoder for a draft first (JPEG decodes straight
+    to 1/2, 1/4 or 1/8 scale), then box-reduces whatever is left.
+    """
+    with Image.open(path) as img:
+        img.thumbnail((size, size), Image.BOX, reducing_gap=2.0)
+        return np.asarray(img.convert("RGB"), dtype=np.float32)
+
+
+def format_extension(fmt: str | None) -> str | None:
+    """File extension for a Pillow format name ("JPEG", "MPO", "PNG", …),
+    or None if it is not one of IMAGE_EXTENSIONS."""
+    fmt = (fmt or "").lower()
+    ext = ".jpg" if fmt in JPEG_FORMATS else f".{fmt}"
+    return ext if ext in IMAGE_EXTENSIONS else None
@@ -1,5 +1,7 @@
 /** Shared era configuration — used by index, archive pages, and tools. */
 
+import renditions from './renditions.json';
+
 export const ERA_FOLDERS: Record<number, string> = {
   1:  '01_ancient_egypt_and_mesopotamia',
   2:  '02_ancient_greece_and_rome',
@@ -34,3 +36,22 @@ export const ERA_SLUGS: Record<number, string> = {
 export const SLUG_TO_INDEX: Record<string, number> = Object.fromEntries(
   Object.entries(ERA_SLUGS).map(([idx, slug]) => [slug, Number(idx)])
 );
+
+/** One entry of src/data/renditions.json. */
+interface Rendition {
+  src: string;
+  width: number;
+  bytes: number;
+}
+
+/**
+ * Build an `<img srcset>` value for one era image, or undefined if none.
+ * Uses the responsive widths written by convert_webp.py, keyed by
+ * `<folder>/<stem>`; missing entries (e.g. images promoted by hand) fall
+ * back to the plain src.
+ */
+export function eraSrcset(folder: string, stem: string): string | undefined {
+  const ladder = (renditions as Record<string, Rendition[]>)[`${folder}/${stem}`];
+  if (!ladder || ladder.length < 2) return undefined;
+  return ladder.map((r) => `${r.src} ${r.width}w`).join(', ');
+}